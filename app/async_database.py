@@ -1,16 +1,123 @@
+import asyncio
+import collections
 import contextlib
+import pathlib
 import typing
+from collections.abc import Collection, Mapping
 
 import aiosqlite
 
-from .database import AbstractDatabase, MessagePriority, UserProfile
+from .database import DEFAULT_PROFILE, AbstractDatabase, MessagePriority, Ranking, UserProfile
+
+READERS = 4
+BUSY_TIMEOUT = 5000
+CACHE_SIZE_KIB = 16384
+MMAP_SIZE = 256 * 1024 * 1024
+# how many profiles to get per query, keeping well under SQLite's limit on parameters
+PROFILES_PER_QUERY = 400
+# priorities are stored as their index in here, so new ones must be added at the end
+PRIORITIES = [MessagePriority.BOTTOM, MessagePriority.MIDDLE, MessagePriority.TOP]
+PRIORITY_CODES = {priority: code for code, priority in enumerate(PRIORITIES)}
+
+# the statements that bring the schema from one version to the next, tracked in `PRAGMA user_version`
+MIGRATIONS: list[list[str]] = [
+    # the schema from before versioning, so existing databases are left as they are
+    [
+        """CREATE TABLE IF NOT EXISTS Guilds (
+                id int,
+                channel int,
+                PRIMARY KEY (id, channel)) STRICT""",
+        """CREATE TABLE IF NOT EXISTS Users (
+                user_id int,
+                guild_id int,
+                cps int NOT NULL,
+                coins int NOT NULL,
+                priority text NOT NULL,
+                PRIMARY KEY (user_id, guild_id)) STRICT""",
+        # for leaderboards, which are read from the highest value down
+        "CREATE INDEX IF NOT EXISTS UsersByCoins ON Users(guild_id, coins, user_id)",
+        "CREATE INDEX IF NOT EXISTS UsersByCps ON Users(guild_id, cps, user_id)",
+        """CREATE TABLE IF NOT EXISTS Snapshots (
+                guild_id int,
+                channel int,
+                state blob NOT NULL,
+                PRIMARY KEY (guild_id, channel)) STRICT""",
+    ],
+    # rows are stored in their primary key's b-tree, with users of a guild next to each other,
+    # and priorities take one byte instead of a string
+    [
+        """CREATE TABLE NewGuilds (
+                id int,
+                channel int,
+                PRIMARY KEY (id, channel)) STRICT, WITHOUT ROWID""",
+        "INSERT INTO NewGuilds(id, channel) SELECT id, channel FROM Guilds",
+        "DROP TABLE Guilds",
+        "ALTER TABLE NewGuilds RENAME TO Guilds",
+        """CREATE TABLE NewUsers (
+                guild_id int,
+                user_id int,
+                cps int NOT NULL,
+                coins int NOT NULL,
+                priority int NOT NULL,
+                PRIMARY KEY (guild_id, user_id)) STRICT, WITHOUT ROWID""",
+        f"""INSERT INTO NewUsers(guild_id, user_id, cps, coins, priority)
+                SELECT guild_id, user_id, cps, coins, CASE priority
+                    {" ".join(f"WHEN '{priority}' THEN {code}" for priority, code in PRIORITY_CODES.items())}
+                END FROM Users""",  # noqa: S608; only the priorities are formatted in
+        "DROP TABLE Users",
+        "ALTER TABLE NewUsers RENAME TO Users",
+        "CREATE INDEX UsersByCoins ON Users(guild_id, coins, user_id)",
+        "CREATE INDEX UsersByCps ON Users(guild_id, cps, user_id)",
+    ],
+    # values the bot keeps about itself
+    [
+        """CREATE TABLE Settings (
+                key text PRIMARY KEY,
+                value text NOT NULL) STRICT, WITHOUT ROWID""",
+    ],
+]
 
 
 class AsyncDatabase(AbstractDatabase):
     """Class to store user profile and channel data asynchronously."""
 
-    def __init__(self, connection: aiosqlite.Connection) -> None:
+    def __init__(self, connection: aiosqlite.Connection, readers: list[aiosqlite.Connection] | None = None) -> None:
         self.connection = connection
+        # reads are spread over these, so that they don't wait behind writes on `connection`
+        self.readers: asyncio.Queue[aiosqlite.Connection] = asyncio.Queue()
+        for reader in readers or [connection]:
+            self.readers.put_nowait(reader)
+        # mirrors the Guilds table, so that checking a channel doesn't need a query
+        self.enabled: dict[int, set[int]] = collections.defaultdict(set)
+        # writes share `connection`, so only one of them can have a transaction open at a time
+        self._writer = asyncio.Lock()
+
+    @contextlib.asynccontextmanager
+    async def _reader(self) -> typing.AsyncIterator[aiosqlite.Connection]:
+        reader = await self.readers.get()
+        try:
+            yield reader
+        finally:
+            self.readers.put_nowait(reader)
+
+    @contextlib.asynccontextmanager
+    async def _transaction(self) -> typing.AsyncIterator[None]:
+        """Run writes as one transaction, which is rolled back if any of them fail."""
+        async with self._writer:
+            await self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                await self.connection.rollback()
+                raise
+            await self.connection.commit()
+
+    async def load_channels(self) -> None:
+        """Load every enabled channel into memory."""
+        self.enabled.clear()
+        async with self._reader() as reader, reader.execute("SELECT id, channel FROM Guilds") as cursor:
+            async for guild_id, channel_id in cursor:
+                self.enabled[guild_id].add(channel_id)
 
     async def enable_channel(self, guild_id: int, channel_id: int) -> None:
         """Enable the game in a channel.
@@ -21,11 +128,12 @@ class AsyncDatabase(AbstractDatabase):
         channel_id (int): The channel that the game is to be enabled in
 
         """
-        await self.connection.execute(
-            "INSERT INTO Guilds(id, channel) VALUES (?,?)",
-            (guild_id, channel_id),
-        )
-        await self.connection.commit()
+        async with self._transaction():
+            await self.connection.execute(
+                "INSERT INTO Guilds(id, channel) VALUES (?,?)",
+                (guild_id, channel_id),
+            )
+        self.enabled[guild_id].add(channel_id)
 
     async def disable_channel(self, guild_id: int, channel_id: int) -> None:
         """Disable the game in a channel.
@@ -36,8 +144,23 @@ class AsyncDatabase(AbstractDatabase):
         channel_id (int): The channel that the game is to be disabled in
 
         """
-        await self.connection.execute("DELETE FROM Guilds WHERE id=? AND channel=?", (guild_id, channel_id))
-        await self.connection.commit()
+        async with self._transaction():
+            await self.connection.execute("DELETE FROM Guilds WHERE id=? AND channel=?", (guild_id, channel_id))
+        self.enabled[guild_id].discard(channel_id)
+        if not self.enabled[guild_id]:
+            del self.enabled[guild_id]
+
+    async def disable_channels(self, guild_id: int) -> None:
+        """Disable the game in every channel of a guild.
+
+        Arguments:
+        ---------
+        guild_id (int): The guild that the game is to be disabled in
+
+        """
+        async with self._transaction():
+            await self.connection.execute("DELETE FROM Guilds WHERE id=?", (guild_id,))
+        self.enabled.pop(guild_id, None)
 
     async def get_channels(self, guild_id: int) -> list[int]:
         """Get all the channels that the game is in enabled in.
@@ -47,10 +170,18 @@ class AsyncDatabase(AbstractDatabase):
         guild_id (int): The guild to get all enabled channels in
 
         """
-        async with (
-            self.connection.execute("SELECT channel FROM Guilds WHERE id = ?", (guild_id,)) as cursor,
-        ):
-            return [row[0] async for row in cursor]
+        return list(self.enabled.get(guild_id, ()))
+
+    async def is_enabled(self, guild_id: int, channel_id: int) -> bool:
+        """Check whether the game is enabled in a channel.
+
+        Arguments:
+        ---------
+        guild_id (int): The guild that the channel is in
+        channel_id (int): The channel to check
+
+        """
+        return channel_id in self.enabled.get(guild_id, ())
 
     async def remove_profile(self, guild_id: int, user_id: int) -> None:
         """Remove a profile from a specific guild.
@@ -61,8 +192,36 @@ class AsyncDatabase(AbstractDatabase):
         user_id (int): This user whose profile is to be removed
 
         """
-        await self.connection.execute("DELETE FROM Users WHERE user_id=? AND guild_id=?", (user_id, guild_id))
-        await self.connection.commit()
+        async with self._transaction():
+            await self.connection.execute("DELETE FROM Users WHERE user_id=? AND guild_id=?", (user_id, guild_id))
+
+    async def remove_profiles(self, keys: Collection[tuple[int, int]]) -> None:
+        """Remove many profiles at once.
+
+        Arguments:
+        ---------
+        keys (Collection[tuple[int, int]]): The profiles to remove, as (guild_id, user_id)
+
+        """
+        async with self._transaction():
+            await self.connection.executemany(
+                "DELETE FROM Users WHERE user_id=? AND guild_id=?", [(user_id, guild_id) for guild_id, user_id in keys]
+            )
+
+    async def purge_guild(self, guild_id: int) -> None:
+        """Remove every enabled channel, profile and sender snapshot of a guild.
+
+        Arguments:
+        ---------
+        guild_id (int): The guild to remove everything of
+
+        """
+        # in one transaction, so a guild is never left half removed
+        async with self._transaction():
+            await self.connection.execute("DELETE FROM Guilds WHERE id=?", (guild_id,))
+            await self.connection.execute("DELETE FROM Users WHERE guild_id=?", (guild_id,))
+            await self.connection.execute("DELETE FROM Snapshots WHERE guild_id=?", (guild_id,))
+        self.enabled.pop(guild_id, None)
 
     async def get_profile(self, guild_id: int, user_id: int) -> UserProfile:
         """Get a profile from a specific guild, if the user object does not have the guild already attached to it.
@@ -74,14 +233,76 @@ class AsyncDatabase(AbstractDatabase):
 
         """
         async with (
-            self.connection.execute(
+            self._reader() as reader,
+            reader.execute(
                 "SELECT coins, cps, priority FROM Users WHERE guild_id = ? AND user_id = ?", (guild_id, user_id)
             ) as cursor,
         ):
             async for row in cursor:
-                return UserProfile(coins=row[0], cps=row[1], priority=MessagePriority(row[2]))
+                return UserProfile(coins=row[0], cps=row[1], priority=PRIORITIES[row[2]])
+
+        return DEFAULT_PROFILE
+
+    async def get_profiles(self, keys: Collection[tuple[int, int]]) -> dict[tuple[int, int], UserProfile]:
+        """Get many profiles at once.
+
+        Arguments:
+        ---------
+        keys (Collection[tuple[int, int]]): The profiles to get, as (guild_id, user_id)
+
+        """
+        profiles = dict.fromkeys(keys, DEFAULT_PROFILE)
+        # a row value IN list can't use the primary key, but a guild and a list of its users can
+        users: dict[int, list[int]] = collections.defaultdict(list)
+        for guild_id, user_id in profiles:
+            users[guild_id].append(user_id)
+
+        async with self._reader() as reader:
+            for guild_id, user_ids in users.items():
+                for start in range(0, len(user_ids), PROFILES_PER_QUERY):
+                    chunk = user_ids[start : start + PROFILES_PER_QUERY]
+                    placeholders = ", ".join(["?"] * len(chunk))
+                    async with reader.execute(
+                        f"""SELECT user_id, coins, cps, priority FROM Users
+                                WHERE guild_id = ? AND user_id IN ({placeholders})""",  # noqa: S608; only placeholders are formatted in
+                        (guild_id, *chunk),
+                    ) as cursor:
+                        async for user_id, coins, cps, priority in cursor:
+                            profiles[guild_id, user_id] = UserProfile(
+                                coins=coins, cps=cps, priority=PRIORITIES[priority]
+                            )
+
+        return profiles
 
-        return UserProfile()
+    async def get_leaderboard(
+        self, guild_id: int, ranking: Ranking, after: tuple[int, int] | None = None, limit: int = 10
+    ) -> list[tuple[int, UserProfile]]:
+        """Get the users of a guild with the most coins or cps, as (user_id, profile), best first.
+
+        Ties are ranked by user_id, highest first.
+
+        Arguments:
+        ---------
+        guild_id (int): The guild to rank the users of
+        ranking (Ranking): What to rank users by
+        after (tuple[int, int] | None): The (value, user_id) of the last user of the previous page, if any
+        limit (int): How many users to get
+
+        """
+        # `ranking` can only be one of the column names, so it is safe to format in
+        keyset = f"AND ({ranking}, user_id) < (?3, ?4)" if after else ""
+        async with (
+            self._reader() as reader,
+            reader.execute(
+                f"""SELECT user_id, coins, cps, priority FROM Users WHERE guild_id = ?1 {keyset}
+                        ORDER BY {ranking} DESC, user_id DESC LIMIT ?2""",  # noqa: S608
+                (guild_id, limit, *(after or ())),
+            ) as cursor,
+        ):
+            return [
+                (user_id, UserProfile(coins=coins, cps=cps, priority=PRIORITIES[priority]))
+                async for user_id, coins, cps, priority in cursor
+            ]
 
     async def update_profile(self, guild_id: int, user_id: int, new_profile: UserProfile) -> None:
         """Replace a profile with a new profile with updated values.
@@ -93,38 +314,205 @@ class AsyncDatabase(AbstractDatabase):
         new_profile (UserProfile): The new profile with updated values that is to be inserted.
 
         """
-        await self.connection.execute(
-            """INSERT INTO Users(user_id, guild_id, cps, coins, priority) VALUES (?1, ?2, ?3, ?4, ?5)
-                    ON CONFLICT(user_id, guild_id) DO UPDATE
-                            SET cps = ?3, coins = ?4, priority = ?5""",
-            (user_id, guild_id, new_profile.cps, new_profile.coins, str(new_profile.priority)),
-        )
-        await self.connection.commit()
+        async with self._transaction():
+            await self.connection.execute(
+                """INSERT INTO Users(user_id, guild_id, cps, coins, priority) VALUES (?1, ?2, ?3, ?4, ?5)
+                        ON CONFLICT(user_id, guild_id) DO UPDATE
+                                SET cps = ?3, coins = ?4, priority = ?5""",
+                (user_id, guild_id, new_profile.cps, new_profile.coins, PRIORITY_CODES[new_profile.priority]),
+            )
+
+    async def add_coins(self, coins: Mapping[tuple[int, int], int]) -> None:
+        """Give coins to many users at once.
+
+        Arguments:
+        ---------
+        coins (Mapping[tuple[int, int], int]): How many coins to give, keyed by (guild_id, user_id)
+
+        """
+        default = DEFAULT_PROFILE
+        async with self._transaction():
+            await self.connection.executemany(
+                """INSERT INTO Users(user_id, guild_id, cps, coins, priority) VALUES (?1, ?2, ?3, ?4, ?5)
+                        ON CONFLICT(user_id, guild_id) DO UPDATE
+                                SET coins = coins + ?6""",
+                [
+                    (user_id, guild_id, default.cps, default.coins + amount, PRIORITY_CODES[default.priority], amount)
+                    for (guild_id, user_id), amount in coins.items()
+                ],
+            )
+
+    async def upgrade_profile(
+        self, guild_id: int, user_id: int, profile: UserProfile, new_profile: UserProfile
+    ) -> UserProfile | None:
+        """Apply an upgrade that was priced from `profile`, in one step.
+
+        The user pays `profile.coins - new_profile.coins` out of the coins they have now, so coins
+        earned in the meantime are kept. Nothing changes if their cps or priority no longer match
+        `profile` or they can't afford it.
+
+        Arguments:
+        ---------
+        guild_id (int): The guild in which the profile is in
+        user_id (int): The user whose profile will be upgraded
+        profile (UserProfile): The profile that the upgrade was based on
+        new_profile (UserProfile): The profile after the upgrade
+
+        Returns the upgraded profile, or None if nothing changed.
+
+        """
+        async with (
+            self._transaction(),
+            self.connection.execute(
+                """UPDATE Users SET coins = coins - ?1, cps = ?2, priority = ?3
+                        WHERE guild_id = ?4 AND user_id = ?5 AND cps = ?6 AND priority = ?7 AND coins >= ?1
+                        RETURNING coins, cps, priority""",
+                (
+                    profile.coins - new_profile.coins,
+                    new_profile.cps,
+                    PRIORITY_CODES[new_profile.priority],
+                    guild_id,
+                    user_id,
+                    profile.cps,
+                    PRIORITY_CODES[profile.priority],
+                ),
+            ) as cursor,
+        ):
+            row = await cursor.fetchone()
+
+        if row is None:
+            return None
+        return UserProfile(coins=row[0], cps=row[1], priority=PRIORITIES[row[2]])
+
+    async def save_snapshots(self, snapshots: Mapping[tuple[int, int], bytes | None]) -> None:
+        """Save sender snapshots, removing the ones that map to None.
+
+        Arguments:
+        ---------
+        snapshots (Mapping[tuple[int, int], bytes | None]): The snapshots, keyed by (guild_id, channel_id)
+
+        """
+        async with self._transaction():
+            await self.connection.executemany(
+                "DELETE FROM Snapshots WHERE guild_id=? AND channel=?",
+                [key for key, state in snapshots.items() if state is None],
+            )
+            await self.connection.executemany(
+                """INSERT INTO Snapshots(guild_id, channel, state) VALUES (?1, ?2, ?3)
+                        ON CONFLICT(guild_id, channel) DO UPDATE
+                                SET state = ?3""",
+                [(*key, state) for key, state in snapshots.items() if state is not None],
+            )
+
+    async def load_snapshots(self) -> dict[tuple[int, int], bytes]:
+        """Get every saved sender snapshot, keyed by (guild_id, channel_id)."""
+        async with (
+            self._reader() as reader,
+            reader.execute("SELECT guild_id, channel, state FROM Snapshots") as cursor,
+        ):
+            return {(guild_id, channel_id): state async for guild_id, channel_id, state in cursor}
+
+    async def get_setting(self, key: str) -> str | None:
+        """Get a value that the bot saved for itself, if there is one.
+
+        Arguments:
+        ---------
+        key (str): The name of the value
+
+        """
+        async with (
+            self._reader() as reader,
+            reader.execute("SELECT value FROM Settings WHERE key = ?", (key,)) as cursor,
+        ):
+            row = await cursor.fetchone()
+        return row[0] if row else None
+
+    async def set_setting(self, key: str, value: str) -> None:
+        """Save a value for the bot itself, replacing any value with the same name.
+
+        Arguments:
+        ---------
+        key (str): The name of the value
+        value (str): The value to save
+
+        """
+        async with self._transaction():
+            await self.connection.execute(
+                """INSERT INTO Settings(key, value) VALUES (?1, ?2)
+                        ON CONFLICT(key) DO UPDATE
+                                SET value = ?2""",
+                (key, value),
+            )
+
+
+async def _connect(database: str, *, uri: bool = False) -> aiosqlite.Connection:
+    """Connect to a database, tuned for many small reads and writes."""
+    db = await aiosqlite.connect(database, uri=uri)
+    # a busy WAL database can be locked for a moment while it is checkpointed
+    await db.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT}")
+    # in WAL mode, a crash can only lose the latest transactions, so there's no need to sync every commit
+    await db.execute("PRAGMA synchronous = NORMAL")
+    await db.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KIB}")
+    await db.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    await db.execute("PRAGMA temp_store = MEMORY")
+    return db
+
+
+async def _user_version(db: aiosqlite.Connection) -> int:
+    async with db.execute("PRAGMA user_version") as cursor:
+        row = await cursor.fetchone()
+    return row[0] if row else 0
+
+
+async def migrate(db: aiosqlite.Connection) -> None:
+    """Run the migrations that a database hasn't had yet, each in its own transaction.
+
+    Arguments:
+    ---------
+    db (aiosqlite.Connection): The connection to migrate the database through
+
+    """
+    for version, statements in enumerate(MIGRATIONS, start=1):
+        if await _user_version(db) >= version:
+            continue
+
+        # takes the write lock first, so processes starting together run each migration once
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            if await _user_version(db) < version:
+                for statement in statements:
+                    await db.execute(statement)
+                await db.execute(f"PRAGMA user_version = {version}")
+        except BaseException:
+            await db.rollback()
+            raise
+        await db.commit()
 
 
 @contextlib.asynccontextmanager
-async def open_database(path: str) -> typing.AsyncIterator[AsyncDatabase]:
-    """Open a database through a shared connection.
+async def open_database(path: str, readers: int = READERS) -> typing.AsyncIterator[AsyncDatabase]:
+    """Open a database through a shared writer connection and a pool of reader connections.
 
     Arguments:
     ---------
     path (str): The path of the database to open
+    readers (int): How many read-only connections to open
 
     """
-    async with aiosqlite.connect(path) as db:
-        # initialize tables if needed
-        await db.execute("""CREATE TABLE IF NOT EXISTS Guilds (
-                            id int,
-                            channel int,
-                            PRIMARY KEY (id, channel)) STRICT""")
-        await db.commit()
-        await db.execute("""CREATE TABLE IF NOT EXISTS Users (
-                            user_id int,
-                            guild_id int,
-                            cps int NOT NULL,
-                            coins int NOT NULL,
-                            priority text NOT NULL,
-                            PRIMARY KEY (user_id, guild_id)) STRICT""")
-        await db.commit()
+    async with contextlib.AsyncExitStack() as stack:
+        db = await _connect(path)
+        stack.push_async_callback(db.close)
+        # readers never block the writer (or each other) in WAL mode
+        await db.execute("PRAGMA journal_mode = WAL")
+        await migrate(db)
+
+        connections = []
+        if path != ":memory:":
+            for _ in range(readers):
+                reader = await _connect(f"{pathlib.Path(path).absolute().as_uri()}?mode=ro", uri=True)
+                stack.push_async_callback(reader.close)
+                connections.append(reader)
 
-        yield AsyncDatabase(db)
+        database = AsyncDatabase(db, connections)
+        await database.load_channels()
+        yield database
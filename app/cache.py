@@ -0,0 +1,204 @@
+from __future__ import annotations
+
+import collections
+import contextlib
+import dataclasses
+from typing import TYPE_CHECKING
+
+from .database import AbstractDatabase, DatabaseWrapper, UserProfile
+
+if TYPE_CHECKING:
+    from collections.abc import Collection, Iterator, Mapping
+
+CACHE_SIZE = 10000
+
+
+class ProfileCache(DatabaseWrapper):
+    """Database wrapper that keeps recently used profiles in memory.
+
+    Profiles are evicted least recently used first once there are more than `max_size` of them.
+    """
+
+    def __init__(self, database: AbstractDatabase, max_size: int = CACHE_SIZE) -> None:
+        super().__init__(database)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._profiles: collections.OrderedDict[tuple[int, int], UserProfile] = collections.OrderedDict()
+        # used so that reads racing a write don't cache stale profiles
+        self._generation = 0
+        self._writes = 0
+
+    @contextlib.contextmanager
+    def _writing(self) -> Iterator[int]:
+        self._generation += 1
+        self._writes += 1
+        try:
+            yield self._generation
+        finally:
+            self._writes -= 1
+
+    def _store(self, key: tuple[int, int], profile: UserProfile) -> None:
+        self._profiles[key] = profile
+        self._profiles.move_to_end(key)
+        while len(self._profiles) > self.max_size:
+            self._profiles.popitem(last=False)
+            self.evictions += 1
+
+    async def remove_profile(self, guild_id: int, user_id: int) -> None:
+        """Remove a profile from a specific guild.
+
+        Arguments:
+        ---------
+        guild_id (int): The guild that the user is in
+        user_id (int): This user whose profile is to be removed
+
+        """
+        with self._writing():
+            self._profiles.pop((guild_id, user_id), None)
+            await self.database.remove_profile(guild_id, user_id)
+
+    async def remove_profiles(self, keys: Collection[tuple[int, int]]) -> None:
+        """Remove many profiles at once.
+
+        Arguments:
+        ---------
+        keys (Collection[tuple[int, int]]): The profiles to remove, as (guild_id, user_id)
+
+        """
+        with self._writing():
+            for key in keys:
+                self._profiles.pop(key, None)
+            await self.database.remove_profiles(keys)
+
+    async def purge_guild(self, guild_id: int) -> None:
+        """Remove every enabled channel, profile and sender snapshot of a guild.
+
+        Arguments:
+        ---------
+        guild_id (int): The guild to remove everything of
+
+        """
+        with self._writing():
+            for key in [key for key in self._profiles if key[0] == guild_id]:
+                del self._profiles[key]
+            await self.database.purge_guild(guild_id)
+
+    async def get_profile(self, guild_id: int, user_id: int) -> UserProfile:
+        """Get a profile from a specific guild, if the user object does not have the guild already attached to it.
+
+        Arguments:
+        ---------
+        guild_id (int): The guild that will be checked
+        user_id (int): The user whose profile that will be returned
+
+        """
+        key = (guild_id, user_id)
+        profile = self._profiles.get(key)
+        if profile is not None:
+            self.hits += 1
+            self._profiles.move_to_end(key)
+            return profile
+
+        self.misses += 1
+        generation = self._generation
+        cacheable = not self._writes
+        profile = await self.database.get_profile(guild_id, user_id)
+        if cacheable and generation == self._generation:
+            self._store(key, profile)
+
+        return profile
+
+    async def get_profiles(self, keys: Collection[tuple[int, int]]) -> dict[tuple[int, int], UserProfile]:
+        """Get many profiles at once.
+
+        Arguments:
+        ---------
+        keys (Collection[tuple[int, int]]): The profiles to get, as (guild_id, user_id)
+
+        """
+        profiles = {}
+        missing = []
+        for key in keys:
+            profile = self._profiles.get(key)
+            if profile is None:
+                missing.append(key)
+            else:
+                self.hits += 1
+                self._profiles.move_to_end(key)
+                profiles[key] = profile
+
+        if missing:
+            self.misses += len(missing)
+            generation = self._generation
+            cacheable = not self._writes
+            fetched = await self.database.get_profiles(missing)
+            if cacheable and generation == self._generation:
+                for key, profile in fetched.items():
+                    self._store(key, profile)
+            profiles.update(fetched)
+
+        return profiles
+
+    async def update_profile(self, guild_id: int, user_id: int, new_profile: UserProfile) -> None:
+        """Replace a profile with a new profile with updated values.
+
+        Arguments:
+        ---------
+        guild_id (int): The guild in which the profile is in
+        user_id (int): The user whose profile will be updated
+        new_profile (UserProfile): The new profile with updated values that is to be inserted.
+
+        """
+        with self._writing() as generation:
+            self._profiles.pop((guild_id, user_id), None)
+            await self.database.update_profile(guild_id, user_id, new_profile)
+            if generation == self._generation:
+                self._store((guild_id, user_id), new_profile)
+
+    async def add_coins(self, coins: Mapping[tuple[int, int], int]) -> None:
+        """Give coins to many users at once.
+
+        Arguments:
+        ---------
+        coins (Mapping[tuple[int, int], int]): How many coins to give, keyed by (guild_id, user_id)
+
+        """
+        with self._writing() as generation:
+            updated = {
+                key: dataclasses.replace(profile, coins=profile.coins + coins[key])
+                for key in coins
+                if (profile := self._profiles.get(key)) is not None
+            }
+            await self.database.add_coins(coins)
+            for key, profile in updated.items():
+                if key not in self._profiles:
+                    continue
+                if generation == self._generation:
+                    self._profiles[key] = profile
+                else:
+                    # another write may have landed first, so the cached profile can't be trusted
+                    del self._profiles[key]
+
+    async def upgrade_profile(
+        self, guild_id: int, user_id: int, profile: UserProfile, new_profile: UserProfile
+    ) -> UserProfile | None:
+        """Apply an upgrade that was priced from `profile`, in one step.
+
+        Arguments:
+        ---------
+        guild_id (int): The guild in which the profile is in
+        user_id (int): The user whose profile will be upgraded
+        profile (UserProfile): The profile that the upgrade was based on
+        new_profile (UserProfile): The profile after the upgrade
+
+        Returns the upgraded profile, or None if nothing changed.
+
+        """
+        with self._writing() as generation:
+            self._profiles.pop((guild_id, user_id), None)
+            upgraded = await self.database.upgrade_profile(guild_id, user_id, profile, new_profile)
+            if upgraded is not None and generation == self._generation:
+                self._store((guild_id, user_id), upgraded)
+            return upgraded
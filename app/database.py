@@ -1,5 +1,6 @@
-import collections
+import dataclasses
 from abc import ABC, abstractmethod
+from collections.abc import Collection, Mapping
 from dataclasses import dataclass
 from enum import StrEnum, auto
 
@@ -12,7 +13,14 @@ class MessagePriority(StrEnum):
     BOTTOM = auto()
 
 
-@dataclass(frozen=True)
+class Ranking(StrEnum):
+    """Enum to determine what users are ranked by, named after the UserProfile fields."""
+
+    COINS = auto()
+    CPS = auto()
+
+
+@dataclass(frozen=True, slots=True)
 class UserProfile:
     """Class to hold user data such as their priority, amount of coins, and characters per second."""
 
@@ -21,6 +29,10 @@ class UserProfile:
     cps: int = 1
 
 
+# profiles are immutable, so every user without one can share this
+DEFAULT_PROFILE = UserProfile()
+
+
 class AbstractDatabase(ABC):
     """An abstract database class to have database implementation."""
 
@@ -46,6 +58,16 @@ class AbstractDatabase(ABC):
 
         """
 
+    @abstractmethod
+    async def disable_channels(self, guild_id: int) -> None:
+        """Disable the game in every channel of a guild.
+
+        Arguments:
+        ---------
+        guild_id (int): The guild that the game is to be disabled in
+
+        """
+
     @abstractmethod
     async def get_channels(self, guild_id: int) -> list[int]:
         """Get all the channels that the game is in enabled in.
@@ -56,6 +78,17 @@ class AbstractDatabase(ABC):
 
         """
 
+    @abstractmethod
+    async def is_enabled(self, guild_id: int, channel_id: int) -> bool:
+        """Check whether the game is enabled in a channel.
+
+        Arguments:
+        ---------
+        guild_id (int): The guild that the channel is in
+        channel_id (int): The channel to check
+
+        """
+
     @abstractmethod
     async def remove_profile(self, guild_id: int, user_id: int) -> None:
         """Remove a profile from a specific guild.
@@ -67,6 +100,26 @@ class AbstractDatabase(ABC):
 
         """
 
+    @abstractmethod
+    async def remove_profiles(self, keys: Collection[tuple[int, int]]) -> None:
+        """Remove many profiles at once.
+
+        Arguments:
+        ---------
+        keys (Collection[tuple[int, int]]): The profiles to remove, as (guild_id, user_id)
+
+        """
+
+    @abstractmethod
+    async def purge_guild(self, guild_id: int) -> None:
+        """Remove every enabled channel, profile and sender snapshot of a guild.
+
+        Arguments:
+        ---------
+        guild_id (int): The guild to remove everything of
+
+        """
+
     @abstractmethod
     async def get_profile(self, guild_id: int, user_id: int) -> UserProfile:
         """Get a profile from a specific guild, if the user object does not have the guild already attached to it.
@@ -78,6 +131,33 @@ class AbstractDatabase(ABC):
 
         """
 
+    @abstractmethod
+    async def get_profiles(self, keys: Collection[tuple[int, int]]) -> dict[tuple[int, int], UserProfile]:
+        """Get many profiles at once.
+
+        Arguments:
+        ---------
+        keys (Collection[tuple[int, int]]): The profiles to get, as (guild_id, user_id)
+
+        """
+
+    @abstractmethod
+    async def get_leaderboard(
+        self, guild_id: int, ranking: Ranking, after: tuple[int, int] | None = None, limit: int = 10
+    ) -> list[tuple[int, UserProfile]]:
+        """Get the users of a guild with the most coins or cps, as (user_id, profile), best first.
+
+        Ties are ranked by user_id, highest first.
+
+        Arguments:
+        ---------
+        guild_id (int): The guild to rank the users of
+        ranking (Ranking): What to rank users by
+        after (tuple[int, int] | None): The (value, user_id) of the last user of the previous page, if any
+        limit (int): How many users to get
+
+        """
+
     @abstractmethod
     async def update_profile(self, guild_id: int, user_id: int, new_profile: UserProfile) -> None:
         """Replace a profile with a new profile with updated values.
@@ -92,15 +172,361 @@ class AbstractDatabase(ABC):
 
         """
 
+    @abstractmethod
+    async def add_coins(self, coins: Mapping[tuple[int, int], int]) -> None:
+        """Give coins to many users at once.
+
+        Arguments:
+        ---------
+        coins (Mapping[tuple[int, int], int]): How many coins to give, keyed by (guild_id, user_id)
+
+        """
+
+    @abstractmethod
+    async def upgrade_profile(
+        self, guild_id: int, user_id: int, profile: UserProfile, new_profile: UserProfile
+    ) -> UserProfile | None:
+        """Apply an upgrade that was priced from `profile`, in one step.
+
+        The user pays `profile.coins - new_profile.coins` out of the coins they have now, so coins
+        earned in the meantime are kept. Nothing changes if their cps or priority no longer match
+        `profile` or they can't afford it.
+
+        Arguments:
+        ---------
+        guild_id (int): The guild in which the profile is in
+        user_id (int): The user whose profile will be upgraded
+        profile (UserProfile): The profile that the upgrade was based on
+        new_profile (UserProfile): The profile after the upgrade
+
+        Returns the upgraded profile, or None if nothing changed.
+
+        """
+
+    @abstractmethod
+    async def save_snapshots(self, snapshots: Mapping[tuple[int, int], bytes | None]) -> None:
+        """Save sender snapshots, removing the ones that map to None.
+
+        Arguments:
+        ---------
+        snapshots (Mapping[tuple[int, int], bytes | None]): The snapshots, keyed by (guild_id, channel_id)
+
+        """
+
+    @abstractmethod
+    async def load_snapshots(self) -> dict[tuple[int, int], bytes]:
+        """Get every saved sender snapshot, keyed by (guild_id, channel_id)."""
+
+    @abstractmethod
+    async def get_setting(self, key: str) -> str | None:
+        """Get a value that the bot saved for itself, if there is one.
+
+        Arguments:
+        ---------
+        key (str): The name of the value
+
+        """
+
+    @abstractmethod
+    async def set_setting(self, key: str, value: str) -> None:
+        """Save a value for the bot itself, replacing any value with the same name.
+
+        Arguments:
+        ---------
+        key (str): The name of the value
+        value (str): The value to save
+
+        """
+
 
 class Database(AbstractDatabase):
-    """Class to store user profile and channel data."""
+    """Class to store user profile and channel data.
+
+    Users without a profile get `DEFAULT_PROFILE` and are only stored once it changes. If
+    `max_profiles` is set, storing more profiles than that drops the least recently written
+    profile of the least recently written guild.
+    """
+
+    def __init__(self, max_profiles: int | None = None) -> None:
+        self.max_profiles = max_profiles
+        self.enabled: dict[int, set[int]] = {}
+        # with `max_profiles` set, guilds and their profiles are both kept least recently written first
+        self.activeProfiles: dict[int, dict[int, UserProfile]] = {}
+        self.size = 0
+        self.snapshots: dict[tuple[int, int], bytes] = {}
+        self.settings: dict[str, str] = {}
+
+    def _profile(self, guild_id: int, user_id: int) -> UserProfile:
+        return self.activeProfiles.get(guild_id, {}).get(user_id, DEFAULT_PROFILE)
+
+    def _store(self, guild_id: int, user_id: int, profile: UserProfile) -> None:
+        if self.max_profiles is None:
+            # nothing is ever dropped, so profiles are updated in place instead of being moved to the end
+            profiles = self.activeProfiles.get(guild_id)
+            if profiles is None:
+                profiles = self.activeProfiles[guild_id] = {}
+            if user_id not in profiles:
+                self.size += 1
+            profiles[user_id] = profile
+            return
+
+        profiles = self.activeProfiles.pop(guild_id, None) or {}
+        self.activeProfiles[guild_id] = profiles
+        if profiles.pop(user_id, None) is None:
+            self.size += 1
+        profiles[user_id] = profile
+
+        while self.max_profiles is not None and self.size > self.max_profiles:
+            oldest = next(iter(self.activeProfiles))
+            self._remove(oldest, next(iter(self.activeProfiles[oldest])))
+
+    def _remove(self, guild_id: int, user_id: int) -> None:
+        profiles = self.activeProfiles.get(guild_id)
+        if profiles is None or profiles.pop(user_id, None) is None:
+            return
+
+        self.size -= 1
+        if not profiles:
+            del self.activeProfiles[guild_id]
+
+    async def enable_channel(self, guild_id: int, channel_id: int) -> None:
+        """Enable the game in a channel.
+
+        Arguments:
+        ---------
+        guild_id (int): The guild that the game is to be enabled in
+        channel_id (int): The channel that the game is to be enabled in
+
+        """
+        self.enabled.setdefault(guild_id, set()).add(channel_id)
 
-    def __init__(self) -> None:
-        self.enabled: dict[int, list[int]] = collections.defaultdict(list)
-        self.activeProfiles: dict[int, dict[int, UserProfile]] = collections.defaultdict(
-            lambda: collections.defaultdict(UserProfile),
+    async def disable_channel(self, guild_id: int, channel_id: int) -> None:
+        """Disable the game in a channel.
+
+        Arguments:
+        ---------
+        guild_id (int): The guild that the game is to be disabled in
+        channel_id (int): The channel that the game is to be disabled in
+
+        """
+        channels = self.enabled.get(guild_id, set())
+        channels.discard(channel_id)
+        if not channels:
+            self.enabled.pop(guild_id, None)
+
+    async def disable_channels(self, guild_id: int) -> None:
+        """Disable the game in every channel of a guild.
+
+        Arguments:
+        ---------
+        guild_id (int): The guild that the game is to be disabled in
+
+        """
+        self.enabled.pop(guild_id, None)
+
+    async def get_channels(self, guild_id: int) -> list[int]:
+        """Get all the channels that the game is in enabled in.
+
+        Arguments:
+        ---------
+        guild_id (int): The guild to get all enabled channels in
+
+        """
+        return list(self.enabled.get(guild_id, ()))
+
+    async def is_enabled(self, guild_id: int, channel_id: int) -> bool:
+        """Check whether the game is enabled in a channel.
+
+        Arguments:
+        ---------
+        guild_id (int): The guild that the channel is in
+        channel_id (int): The channel to check
+
+        """
+        return channel_id in self.enabled.get(guild_id, ())
+
+    async def remove_profile(self, guild_id: int, user_id: int) -> None:
+        """Remove a profile from a specific guild.
+
+        Arguments:
+        ---------
+        guild_id (int): The guild that the user is in
+        user_id (int): This user whose profile is to be removed
+
+        """
+        self._remove(guild_id, user_id)
+
+    async def remove_profiles(self, keys: Collection[tuple[int, int]]) -> None:
+        """Remove many profiles at once.
+
+        Arguments:
+        ---------
+        keys (Collection[tuple[int, int]]): The profiles to remove, as (guild_id, user_id)
+
+        """
+        for guild_id, user_id in keys:
+            self._remove(guild_id, user_id)
+
+    async def purge_guild(self, guild_id: int) -> None:
+        """Remove every enabled channel, profile and sender snapshot of a guild.
+
+        Arguments:
+        ---------
+        guild_id (int): The guild to remove everything of
+
+        """
+        self.enabled.pop(guild_id, None)
+        self.size -= len(self.activeProfiles.pop(guild_id, {}))
+        for key in [key for key in self.snapshots if key[0] == guild_id]:
+            del self.snapshots[key]
+
+    async def get_profile(self, guild_id: int, user_id: int) -> UserProfile:
+        """Get a profile from a specific guild, if the user object does not have the guild already attached to it.
+
+        Arguments:
+        ---------
+        guild_id (int): The guild that will be checked
+        user_id (int): The user whose profile that will be returned
+
+        """
+        return self._profile(guild_id, user_id)
+
+    async def get_profiles(self, keys: Collection[tuple[int, int]]) -> dict[tuple[int, int], UserProfile]:
+        """Get many profiles at once.
+
+        Arguments:
+        ---------
+        keys (Collection[tuple[int, int]]): The profiles to get, as (guild_id, user_id)
+
+        """
+        return {(guild_id, user_id): self._profile(guild_id, user_id) for guild_id, user_id in keys}
+
+    async def get_leaderboard(
+        self, guild_id: int, ranking: Ranking, after: tuple[int, int] | None = None, limit: int = 10
+    ) -> list[tuple[int, UserProfile]]:
+        """Get the users of a guild with the most coins or cps, as (user_id, profile), best first.
+
+        Ties are ranked by user_id, highest first.
+
+        Arguments:
+        ---------
+        guild_id (int): The guild to rank the users of
+        ranking (Ranking): What to rank users by
+        after (tuple[int, int] | None): The (value, user_id) of the last user of the previous page, if any
+        limit (int): How many users to get
+
+        """
+        rows = sorted(
+            self.activeProfiles.get(guild_id, {}).items(),
+            key=lambda row: (getattr(row[1], ranking), row[0]),
+            reverse=True,
         )
+        if after is not None:
+            rows = [(user_id, profile) for user_id, profile in rows if (getattr(profile, ranking), user_id) < after]
+        return rows[:limit]
+
+    async def update_profile(self, guild_id: int, user_id: int, new_profile: UserProfile) -> None:
+        """Replace a profile with a new profile with updated values.
+
+        Arguments:
+        ---------
+        guild_id (int): The guild in which the profile is in
+        user_id (int): The user whose profile will be updated
+        new_profile (UserProfile): The new profile with updated values that is to be inserted.
+
+        If this is not passed in a value of None is used and the profile is not changed
+
+        """
+        self._store(guild_id, user_id, new_profile)
+
+    async def add_coins(self, coins: Mapping[tuple[int, int], int]) -> None:
+        """Give coins to many users at once.
+
+        Arguments:
+        ---------
+        coins (Mapping[tuple[int, int], int]): How many coins to give, keyed by (guild_id, user_id)
+
+        """
+        for (guild_id, user_id), amount in coins.items():
+            profile = self._profile(guild_id, user_id)
+            self._store(guild_id, user_id, dataclasses.replace(profile, coins=profile.coins + amount))
+
+    async def upgrade_profile(
+        self, guild_id: int, user_id: int, profile: UserProfile, new_profile: UserProfile
+    ) -> UserProfile | None:
+        """Apply an upgrade that was priced from `profile`, in one step.
+
+        The user pays `profile.coins - new_profile.coins` out of the coins they have now, so coins
+        earned in the meantime are kept. Nothing changes if their cps or priority no longer match
+        `profile` or they can't afford it.
+
+        Arguments:
+        ---------
+        guild_id (int): The guild in which the profile is in
+        user_id (int): The user whose profile will be upgraded
+        profile (UserProfile): The profile that the upgrade was based on
+        new_profile (UserProfile): The profile after the upgrade
+
+        Returns the upgraded profile, or None if nothing changed.
+
+        """
+        current = self._profile(guild_id, user_id)
+        cost = profile.coins - new_profile.coins
+        if current.cps != profile.cps or current.priority != profile.priority or current.coins < cost:
+            return None
+
+        upgraded = UserProfile(coins=current.coins - cost, cps=new_profile.cps, priority=new_profile.priority)
+        self._store(guild_id, user_id, upgraded)
+        return upgraded
+
+    async def save_snapshots(self, snapshots: Mapping[tuple[int, int], bytes | None]) -> None:
+        """Save sender snapshots, removing the ones that map to None.
+
+        Arguments:
+        ---------
+        snapshots (Mapping[tuple[int, int], bytes | None]): The snapshots, keyed by (guild_id, channel_id)
+
+        """
+        for key, state in snapshots.items():
+            if state is None:
+                self.snapshots.pop(key, None)
+            else:
+                self.snapshots[key] = state
+
+    async def load_snapshots(self) -> dict[tuple[int, int], bytes]:
+        """Get every saved sender snapshot, keyed by (guild_id, channel_id)."""
+        return dict(self.snapshots)
+
+    async def get_setting(self, key: str) -> str | None:
+        """Get a value that the bot saved for itself, if there is one.
+
+        Arguments:
+        ---------
+        key (str): The name of the value
+
+        """
+        return self.settings.get(key)
+
+    async def set_setting(self, key: str, value: str) -> None:
+        """Save a value for the bot itself, replacing any value with the same name.
+
+        Arguments:
+        ---------
+        key (str): The name of the value
+        value (str): The value to save
+
+        """
+        self.settings[key] = value
+
+
+class DatabaseWrapper(AbstractDatabase):
+    """A database that passes everything through to another database.
+
+    Subclasses override the methods they want to change.
+    """
+
+    def __init__(self, database: AbstractDatabase) -> None:
+        self.database = database
 
     async def enable_channel(self, guild_id: int, channel_id: int) -> None:
         """Enable the game in a channel.
@@ -111,7 +537,7 @@ class Database(AbstractDatabase):
         channel_id (int): The channel that the game is to be enabled in
 
         """
-        self.enabled[guild_id].append(channel_id)
+        await self.database.enable_channel(guild_id, channel_id)
 
     async def disable_channel(self, guild_id: int, channel_id: int) -> None:
         """Disable the game in a channel.
@@ -122,7 +548,17 @@ class Database(AbstractDatabase):
         channel_id (int): The channel that the game is to be disabled in
 
         """
-        self.enabled[guild_id].remove(channel_id)
+        await self.database.disable_channel(guild_id, channel_id)
+
+    async def disable_channels(self, guild_id: int) -> None:
+        """Disable the game in every channel of a guild.
+
+        Arguments:
+        ---------
+        guild_id (int): The guild that the game is to be disabled in
+
+        """
+        await self.database.disable_channels(guild_id)
 
     async def get_channels(self, guild_id: int) -> list[int]:
         """Get all the channels that the game is in enabled in.
@@ -132,7 +568,18 @@ class Database(AbstractDatabase):
         guild_id (int): The guild to get all enabled channels in
 
         """
-        return self.enabled[guild_id]
+        return await self.database.get_channels(guild_id)
+
+    async def is_enabled(self, guild_id: int, channel_id: int) -> bool:
+        """Check whether the game is enabled in a channel.
+
+        Arguments:
+        ---------
+        guild_id (int): The guild that the channel is in
+        channel_id (int): The channel to check
+
+        """
+        return await self.database.is_enabled(guild_id, channel_id)
 
     async def remove_profile(self, guild_id: int, user_id: int) -> None:
         """Remove a profile from a specific guild.
@@ -143,7 +590,27 @@ class Database(AbstractDatabase):
         user_id (int): This user whose profile is to be removed
 
         """
-        self.activeProfiles[guild_id].pop(user_id, None)
+        await self.database.remove_profile(guild_id, user_id)
+
+    async def remove_profiles(self, keys: Collection[tuple[int, int]]) -> None:
+        """Remove many profiles at once.
+
+        Arguments:
+        ---------
+        keys (Collection[tuple[int, int]]): The profiles to remove, as (guild_id, user_id)
+
+        """
+        await self.database.remove_profiles(keys)
+
+    async def purge_guild(self, guild_id: int) -> None:
+        """Remove every enabled channel, profile and sender snapshot of a guild.
+
+        Arguments:
+        ---------
+        guild_id (int): The guild to remove everything of
+
+        """
+        await self.database.purge_guild(guild_id)
 
     async def get_profile(self, guild_id: int, user_id: int) -> UserProfile:
         """Get a profile from a specific guild, if the user object does not have the guild already attached to it.
@@ -154,7 +621,34 @@ class Database(AbstractDatabase):
         user_id (int): The user whose profile that will be returned
 
         """
-        return self.activeProfiles[guild_id][user_id]
+        return await self.database.get_profile(guild_id, user_id)
+
+    async def get_profiles(self, keys: Collection[tuple[int, int]]) -> dict[tuple[int, int], UserProfile]:
+        """Get many profiles at once.
+
+        Arguments:
+        ---------
+        keys (Collection[tuple[int, int]]): The profiles to get, as (guild_id, user_id)
+
+        """
+        return await self.database.get_profiles(keys)
+
+    async def get_leaderboard(
+        self, guild_id: int, ranking: Ranking, after: tuple[int, int] | None = None, limit: int = 10
+    ) -> list[tuple[int, UserProfile]]:
+        """Get the users of a guild with the most coins or cps, as (user_id, profile), best first.
+
+        Ties are ranked by user_id, highest first.
+
+        Arguments:
+        ---------
+        guild_id (int): The guild to rank the users of
+        ranking (Ranking): What to rank users by
+        after (tuple[int, int] | None): The (value, user_id) of the last user of the previous page, if any
+        limit (int): How many users to get
+
+        """
+        return await self.database.get_leaderboard(guild_id, ranking, after, limit)
 
     async def update_profile(self, guild_id: int, user_id: int, new_profile: UserProfile) -> None:
         """Replace a profile with a new profile with updated values.
@@ -165,7 +659,71 @@ class Database(AbstractDatabase):
         user_id (int): The user whose profile will be updated
         new_profile (UserProfile): The new profile with updated values that is to be inserted.
 
-        If this is not passed in a value of None is used and the profile is not changed
+        """
+        await self.database.update_profile(guild_id, user_id, new_profile)
+
+    async def add_coins(self, coins: Mapping[tuple[int, int], int]) -> None:
+        """Give coins to many users at once.
+
+        Arguments:
+        ---------
+        coins (Mapping[tuple[int, int], int]): How many coins to give, keyed by (guild_id, user_id)
+
+        """
+        await self.database.add_coins(coins)
+
+    async def upgrade_profile(
+        self, guild_id: int, user_id: int, profile: UserProfile, new_profile: UserProfile
+    ) -> UserProfile | None:
+        """Apply an upgrade that was priced from `profile`, in one step.
+
+        The user pays `profile.coins - new_profile.coins` out of the coins they have now, so coins
+        earned in the meantime are kept. Nothing changes if their cps or priority no longer match
+        `profile` or they can't afford it.
+
+        Arguments:
+        ---------
+        guild_id (int): The guild in which the profile is in
+        user_id (int): The user whose profile will be upgraded
+        profile (UserProfile): The profile that the upgrade was based on
+        new_profile (UserProfile): The profile after the upgrade
+
+        Returns the upgraded profile, or None if nothing changed.
+
+        """
+        return await self.database.upgrade_profile(guild_id, user_id, profile, new_profile)
+
+    async def save_snapshots(self, snapshots: Mapping[tuple[int, int], bytes | None]) -> None:
+        """Save sender snapshots, removing the ones that map to None.
+
+        Arguments:
+        ---------
+        snapshots (Mapping[tuple[int, int], bytes | None]): The snapshots, keyed by (guild_id, channel_id)
+
+        """
+        await self.database.save_snapshots(snapshots)
+
+    async def load_snapshots(self) -> dict[tuple[int, int], bytes]:
+        """Get every saved sender snapshot, keyed by (guild_id, channel_id)."""
+        return await self.database.load_snapshots()
+
+    async def get_setting(self, key: str) -> str | None:
+        """Get a value that the bot saved for itself, if there is one.
+
+        Arguments:
+        ---------
+        key (str): The name of the value
+
+        """
+        return await self.database.get_setting(key)
+
+    async def set_setting(self, key: str, value: str) -> None:
+        """Save a value for the bot itself, replacing any value with the same name.
+
+        Arguments:
+        ---------
+        key (str): The name of the value
+        value (str): The value to save
 
         """
-        self.activeProfiles[guild_id][user_id] = new_profile
+        await self.database.set_setting(key, value)
@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import itertools
+import logging
+import time
+from typing import TYPE_CHECKING
+
+from .metrics import SenderMetrics
+
+if TYPE_CHECKING:
+    from collections.abc import Awaitable, Callable
+
+DELETE_WINDOW = 0.5
+MAX_PENDING_DELETES = 1000
+# the bulk delete endpoint takes between 2 and 100 messages, none older than 2 weeks
+BULK_DELETE_LIMIT = 100
+BULK_DELETE_MAX_AGE = 14 * 24 * 60 * 60
+# leaves time for the request to get to Discord
+BULK_DELETE_MARGIN = 60
+DISCORD_EPOCH = 1420070400
+
+logger = logging.getLogger(__name__)
+
+
+def message_age(message_id: int, now: float) -> float:
+    """Get how many seconds ago a message was sent, from its id."""
+    return now - ((message_id >> 22) / 1000 + DISCORD_EPOCH)
+
+
+@dataclasses.dataclass
+class Deleter:
+    """Deletes messages in batches, with at most one batch in progress per channel.
+
+    Messages are collected for `window` seconds after the first one comes in and then deleted
+    through `delete_many`, `BULK_DELETE_LIMIT` at a time. Messages that are too old for that, or
+    batches of one message, go through `delete_one` instead.
+
+    At most `max_pending` messages wait per channel, any more are not deleted. When a batch
+    can't be deleted at once, its messages are deleted one at a time, and messages that can't be
+    deleted at all are logged and skipped.
+    """
+
+    delete_one: Callable[[int, int], Awaitable[object]]
+    delete_many: Callable[[int, list[int]], Awaitable[object]]
+    metrics: SenderMetrics = dataclasses.field(default_factory=SenderMetrics)
+    window: float = DELETE_WINDOW
+    max_pending: int = MAX_PENDING_DELETES
+    _pending: dict[int, list[int]] = dataclasses.field(init=False, default_factory=dict)
+    _tasks: dict[int, asyncio.Task[None]] = dataclasses.field(init=False, default_factory=dict)
+
+    def delete(self, channel_id: int, message_id: int) -> None:
+        """Delete a message with the next batch for its channel."""
+        pending = self._pending.setdefault(channel_id, [])
+        if len(pending) >= self.max_pending:
+            self.metrics.delete_dropped(channel_id)
+            return
+
+        pending.append(message_id)
+        if channel_id not in self._tasks:
+            self._tasks[channel_id] = asyncio.create_task(self._run(channel_id))
+
+    async def _run(self, channel_id: int) -> None:
+        """Delete batches for a channel until none are left."""
+        try:
+            while self._pending.get(channel_id):
+                await asyncio.sleep(self.window)
+                await self._delete(channel_id, self._pending.pop(channel_id))
+        finally:
+            del self._tasks[channel_id]
+
+    async def close(self) -> None:
+        """Wait until every message that is waiting to be deleted has been."""
+        while self._tasks:
+            await asyncio.gather(*self._tasks.values())
+
+    async def _delete(self, channel_id: int, message_ids: list[int]) -> None:
+        now = time.time()
+        recent = []
+        for message_id in message_ids:
+            if message_age(message_id, now) < BULK_DELETE_MAX_AGE - BULK_DELETE_MARGIN:
+                recent.append(message_id)
+            else:
+                await self._delete_one(channel_id, message_id)
+
+        for batch in itertools.batched(recent, BULK_DELETE_LIMIT):
+            if len(batch) == 1:
+                await self._delete_one(channel_id, batch[0])
+                continue
+
+            try:
+                await self.delete_many(channel_id, list(batch))
+            except Exception:
+                # a single message that can't be bulk deleted fails the whole batch
+                logger.exception("Bulk deleting %d messages in channel %d failed", len(batch), channel_id)
+                for message_id in batch:
+                    await self._delete_one(channel_id, message_id)
+            else:
+                self.metrics.deleted(channel_id, len(batch))
+
+    async def _delete_one(self, channel_id: int, message_id: int) -> None:
+        try:
+            await self.delete_one(channel_id, message_id)
+        except Exception:
+            logger.exception("Deleting message %d in channel %d failed", message_id, channel_id)
+        else:
+            self.metrics.deleted(channel_id, 1)
@@ -0,0 +1,142 @@
+"""Splitting text into grapheme clusters, which are what people see as single characters.
+
+This follows the extended grapheme cluster rules of Unicode Standard Annex #29, using only what
+`unicodedata` knows about. Prepended characters are not handled, and emoji are approximated by
+the symbol category since the emoji properties are not available.
+"""
+
+from __future__ import annotations
+
+import array
+import enum
+import functools
+import unicodedata
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from collections.abc import Sequence
+
+HANGUL_SYLLABLES = range(0xAC00, 0xD7A4)
+HANGUL_SYLLABLE_TRAILS = 28
+
+
+class _Kind(enum.Enum):
+    CR = enum.auto()
+    LF = enum.auto()
+    CONTROL = enum.auto()
+    EXTEND = enum.auto()
+    ZWJ = enum.auto()
+    SPACING_MARK = enum.auto()
+    REGIONAL_INDICATOR = enum.auto()
+    L = enum.auto()
+    V = enum.auto()
+    T = enum.auto()
+    LV = enum.auto()
+    LVT = enum.auto()
+    PICTOGRAPHIC = enum.auto()
+    OTHER = enum.auto()
+
+
+_KINDS_BY_CHAR: dict[str, _Kind] = {
+    "\r": _Kind.CR,
+    "\n": _Kind.LF,
+    # zero width joiner and non-joiner
+    "\u200d": _Kind.ZWJ,
+    "\u200c": _Kind.EXTEND,
+}
+
+_KINDS_BY_RANGE: list[tuple[range, _Kind]] = [
+    # emoji skin tone modifiers and tags, which are not marks but still extend the character before
+    (range(0x1F3FB, 0x1F400), _Kind.EXTEND),
+    (range(0xE0020, 0xE0080), _Kind.EXTEND),
+    (range(0x1F1E6, 0x1F200), _Kind.REGIONAL_INDICATOR),
+    (range(0x1100, 0x1160), _Kind.L),
+    (range(0xA960, 0xA980), _Kind.L),
+    (range(0x1160, 0x11A8), _Kind.V),
+    (range(0xD7B0, 0xD7C7), _Kind.V),
+    (range(0x11A8, 0x1200), _Kind.T),
+    (range(0xD7CB, 0xD7FC), _Kind.T),
+    (range(0x1F000, 0x1FB00), _Kind.PICTOGRAPHIC),
+]
+
+_KINDS_BY_CATEGORY: dict[str, _Kind] = {
+    "Mn": _Kind.EXTEND,
+    "Me": _Kind.EXTEND,
+    "Mc": _Kind.SPACING_MARK,
+    "Cc": _Kind.CONTROL,
+    "Cf": _Kind.CONTROL,
+    "Zl": _Kind.CONTROL,
+    "Zp": _Kind.CONTROL,
+    "So": _Kind.PICTOGRAPHIC,
+}
+
+_HANGUL_FOLLOWERS: dict[_Kind, tuple[_Kind, ...]] = {
+    _Kind.L: (_Kind.L, _Kind.V, _Kind.LV, _Kind.LVT),
+    _Kind.LV: (_Kind.V, _Kind.T),
+    _Kind.V: (_Kind.V, _Kind.T),
+    _Kind.LVT: (_Kind.T,),
+    _Kind.T: (_Kind.T,),
+}
+
+
+@functools.lru_cache(maxsize=4096)
+def _kind(char: str) -> _Kind:
+    if char in _KINDS_BY_CHAR:
+        return _KINDS_BY_CHAR[char]
+
+    codepoint = ord(char)
+    if codepoint in HANGUL_SYLLABLES:
+        return _Kind.LV if (codepoint - HANGUL_SYLLABLES.start) % HANGUL_SYLLABLE_TRAILS == 0 else _Kind.LVT
+    for codepoints, kind in _KINDS_BY_RANGE:
+        if codepoint in codepoints:
+            return kind
+
+    return _KINDS_BY_CATEGORY.get(unicodedata.category(char), _Kind.OTHER)
+
+
+def grapheme_ends(text: str) -> Sequence[int]:
+    """Get the offset just past the end of every grapheme cluster in some text.
+
+    The length of the result is the number of grapheme clusters.
+    """
+    # every character is its own cluster in most messages
+    if text.isascii() and "\r" not in text:
+        return range(1, len(text) + 1)
+
+    ends = array.array("L")
+    previous = None
+    # whether the cluster so far is a pictograph followed by extending characters
+    pictographic = False
+    # whether the last ZWJ came after a pictograph, so that it can join another one
+    joining = False
+    regional_indicators = 0
+
+    for offset, char in enumerate(text):
+        kind = _kind(char)
+        if previous is not None and _breaks(previous, kind, joining=joining, regional_indicators=regional_indicators):
+            ends.append(offset)
+
+        joining = kind == _Kind.ZWJ and pictographic
+        pictographic = kind == _Kind.PICTOGRAPHIC or (pictographic and kind == _Kind.EXTEND)
+        regional_indicators = regional_indicators + 1 if kind == _Kind.REGIONAL_INDICATOR else 0
+        previous = kind
+
+    if text:
+        ends.append(len(text))
+    return ends
+
+
+def _breaks(previous: _Kind, kind: _Kind, *, joining: bool, regional_indicators: int) -> bool:
+    """Check whether there is a cluster boundary between two characters."""
+    if previous == _Kind.CR and kind == _Kind.LF:
+        return False
+    if _Kind.CR in (previous, kind) or _Kind.LF in (previous, kind) or _Kind.CONTROL in (previous, kind):
+        return True
+    if kind in _HANGUL_FOLLOWERS.get(previous, ()):
+        return False
+    if kind in (_Kind.EXTEND, _Kind.ZWJ, _Kind.SPACING_MARK):
+        return False
+    if previous == _Kind.ZWJ and kind == _Kind.PICTOGRAPHIC and joining:
+        return False
+    # flags are pairs of regional indicators
+    return not (kind == _Kind.REGIONAL_INDICATOR and regional_indicators % 2 == 1)
@@ -0,0 +1,231 @@
+from __future__ import annotations
+
+import asyncio
+import collections
+import contextlib
+import dataclasses
+from typing import TYPE_CHECKING
+
+from .database import AbstractDatabase, DatabaseWrapper, Ranking, UserProfile
+
+if TYPE_CHECKING:
+    from collections.abc import AsyncIterator, Collection, Mapping
+
+FLUSH_INTERVAL = 5
+MAX_PENDING = 1000
+
+
+class CoinLedger(DatabaseWrapper):
+    """Database wrapper that holds on to coins and writes them out in batches.
+
+    Reads see coins that have not been written yet, so balances stay correct.
+    """
+
+    def __init__(self, database: AbstractDatabase, max_pending: int = MAX_PENDING) -> None:
+        super().__init__(database)
+        self.max_pending = max_pending
+        self._pending: dict[tuple[int, int], int] = collections.defaultdict(int)
+        self._flushing: dict[tuple[int, int], int] = {}
+        self._lock = asyncio.Lock()
+
+    def _unflushed(self, key: tuple[int, int]) -> int:
+        return self._pending.get(key, 0) + self._flushing.get(key, 0)
+
+    async def flush(self) -> None:
+        """Write all pending coins to the wrapped database in one batch."""
+        async with self._lock:
+            if not self._pending:
+                return
+
+            # keep the batch visible to reads until it is written
+            self._flushing, self._pending = self._pending, collections.defaultdict(int)
+            try:
+                await self.database.add_coins(self._flushing)
+            except BaseException:
+                for key, amount in self._flushing.items():
+                    self._pending[key] += amount
+                raise
+            finally:
+                self._flushing = {}
+
+    async def remove_profile(self, guild_id: int, user_id: int) -> None:
+        """Remove a profile from a specific guild.
+
+        Arguments:
+        ---------
+        guild_id (int): The guild that the user is in
+        user_id (int): This user whose profile is to be removed
+
+        """
+        # an in-flight batch may still recreate the row, so wait for it first
+        async with self._lock:
+            self._pending.pop((guild_id, user_id), None)
+            await self.database.remove_profile(guild_id, user_id)
+
+    async def remove_profiles(self, keys: Collection[tuple[int, int]]) -> None:
+        """Remove many profiles at once.
+
+        Arguments:
+        ---------
+        keys (Collection[tuple[int, int]]): The profiles to remove, as (guild_id, user_id)
+
+        """
+        async with self._lock:
+            for key in keys:
+                self._pending.pop(key, None)
+            await self.database.remove_profiles(keys)
+
+    async def purge_guild(self, guild_id: int) -> None:
+        """Remove every enabled channel, profile and sender snapshot of a guild.
+
+        Arguments:
+        ---------
+        guild_id (int): The guild to remove everything of
+
+        """
+        async with self._lock:
+            for key in [key for key in self._pending if key[0] == guild_id]:
+                del self._pending[key]
+            await self.database.purge_guild(guild_id)
+
+    async def get_profile(self, guild_id: int, user_id: int) -> UserProfile:
+        """Get a profile from a specific guild, if the user object does not have the guild already attached to it.
+
+        Arguments:
+        ---------
+        guild_id (int): The guild that will be checked
+        user_id (int): The user whose profile that will be returned
+
+        """
+        profile = await self.database.get_profile(guild_id, user_id)
+        unflushed = self._unflushed((guild_id, user_id))
+        if unflushed:
+            return dataclasses.replace(profile, coins=profile.coins + unflushed)
+
+        return profile
+
+    async def get_profiles(self, keys: Collection[tuple[int, int]]) -> dict[tuple[int, int], UserProfile]:
+        """Get many profiles at once.
+
+        Arguments:
+        ---------
+        keys (Collection[tuple[int, int]]): The profiles to get, as (guild_id, user_id)
+
+        """
+        profiles = await self.database.get_profiles(keys)
+        for key, profile in profiles.items():
+            if unflushed := self._unflushed(key):
+                profiles[key] = dataclasses.replace(profile, coins=profile.coins + unflushed)
+
+        return profiles
+
+    async def get_leaderboard(
+        self, guild_id: int, ranking: Ranking, after: tuple[int, int] | None = None, limit: int = 10
+    ) -> list[tuple[int, UserProfile]]:
+        """Get the users of a guild with the most coins or cps, as (user_id, profile), best first.
+
+        Ties are ranked by user_id, highest first.
+
+        Arguments:
+        ---------
+        guild_id (int): The guild to rank the users of
+        ranking (Ranking): What to rank users by
+        after (tuple[int, int] | None): The (value, user_id) of the last user of the previous page, if any
+        limit (int): How many users to get
+
+        """
+        # pending coins have to be written first to count
+        await self.flush()
+        return await self.database.get_leaderboard(guild_id, ranking, after, limit)
+
+    async def update_profile(self, guild_id: int, user_id: int, new_profile: UserProfile) -> None:
+        """Replace a profile with a new profile with updated values.
+
+        The user's pending coins are written first instead of being dropped, so the wrapped database
+        sees the same writes in the same order as it would without the ledger.
+
+        Arguments:
+        ---------
+        guild_id (int): The guild in which the profile is in
+        user_id (int): The user whose profile will be updated
+        new_profile (UserProfile): The new profile with updated values that is to be inserted.
+
+        """
+        key = (guild_id, user_id)
+        async with self._lock:
+            if amount := self._pending.pop(key, 0):
+                try:
+                    await self.database.add_coins({key: amount})
+                except BaseException:
+                    self._pending[key] += amount
+                    raise
+            await self.database.update_profile(guild_id, user_id, new_profile)
+
+    async def upgrade_profile(
+        self, guild_id: int, user_id: int, profile: UserProfile, new_profile: UserProfile
+    ) -> UserProfile | None:
+        """Apply an upgrade that was priced from `profile`, in one step.
+
+        Pending coins are written first, so that they can be spent.
+
+        Arguments:
+        ---------
+        guild_id (int): The guild in which the profile is in
+        user_id (int): The user whose profile will be upgraded
+        profile (UserProfile): The profile that the upgrade was based on
+        new_profile (UserProfile): The profile after the upgrade
+
+        Returns the upgraded profile, or None if nothing changed.
+
+        """
+        await self.flush()
+        upgraded = await self.database.upgrade_profile(guild_id, user_id, profile, new_profile)
+        unflushed = self._unflushed((guild_id, user_id))
+        if upgraded is not None and unflushed:
+            return dataclasses.replace(upgraded, coins=upgraded.coins + unflushed)
+
+        return upgraded
+
+    async def add_coins(self, coins: Mapping[tuple[int, int], int]) -> None:
+        """Give coins to many users at once, writing them out later.
+
+        Arguments:
+        ---------
+        coins (Mapping[tuple[int, int], int]): How many coins to give, keyed by (guild_id, user_id)
+
+        """
+        for key, amount in coins.items():
+            self._pending[key] += amount
+
+        if len(self._pending) >= self.max_pending:
+            await self.flush()
+
+
+@contextlib.asynccontextmanager
+async def open_ledger(
+    database: AbstractDatabase, interval: float = FLUSH_INTERVAL, max_pending: int = MAX_PENDING
+) -> AsyncIterator[CoinLedger]:
+    """Wrap a database in a coin ledger that is flushed periodically and on exit.
+
+    Arguments:
+    ---------
+    database (AbstractDatabase): The database to write coins to
+    interval (float): How many seconds to wait between flushes
+    max_pending (int): How many users can have pending coins before flushing early
+
+    """
+    ledger = CoinLedger(database, max_pending)
+
+    async def flush_periodically() -> None:
+        while True:
+            await asyncio.sleep(interval)
+            await ledger.flush()
+
+    task = asyncio.create_task(flush_periodically())
+    try:
+        yield ledger
+    finally:
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+        await ledger.flush()
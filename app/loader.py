@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+from typing import TYPE_CHECKING
+
+from .database import AbstractDatabase, DatabaseWrapper, UserProfile
+
+if TYPE_CHECKING:
+    from collections.abc import Collection, Iterable, Iterator, Mapping
+
+
+class ProfileLoader(DatabaseWrapper):
+    """Database wrapper that gets profiles in batches.
+
+    Profiles asked for in the same iteration of the event loop are fetched with one call to
+    `get_profiles`. Asking for a profile that is already being fetched waits for that fetch.
+    """
+
+    def __init__(self, database: AbstractDatabase) -> None:
+        super().__init__(database)
+        self.batches = 0
+        self.loads = 0
+        self._batch: dict[tuple[int, int], asyncio.Future[UserProfile]] = {}
+        self._loading: dict[tuple[int, int], asyncio.Future[UserProfile]] = {}
+        self._tasks: set[asyncio.Task[None]] = set()
+
+    async def get_profile(self, guild_id: int, user_id: int) -> UserProfile:
+        """Get a profile from a specific guild, if the user object does not have the guild already attached to it.
+
+        Arguments:
+        ---------
+        guild_id (int): The guild that will be checked
+        user_id (int): The user whose profile that will be returned
+
+        """
+        key = (guild_id, user_id)
+        future = self._loading.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            if not self._batch:
+                loop.call_soon(self._dispatch)
+            future = self._batch[key] = self._loading[key] = loop.create_future()
+
+        # so that one caller being cancelled doesn't cancel the rest
+        return await asyncio.shield(future)
+
+    def _dispatch(self) -> None:
+        batch, self._batch = self._batch, {}
+        task = asyncio.create_task(self._load(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _load(self, batch: dict[tuple[int, int], asyncio.Future[UserProfile]]) -> None:
+        self.batches += 1
+        self.loads += len(batch)
+        try:
+            if len(batch) == 1:
+                # the single profile query is simpler for the database
+                [(guild_id, user_id)] = batch
+                profiles = {(guild_id, user_id): await self.database.get_profile(guild_id, user_id)}
+            else:
+                profiles = await self.database.get_profiles(batch.keys())
+        except asyncio.CancelledError:
+            for future in batch.values():
+                future.cancel()
+            raise
+        except Exception as error:  # noqa: BLE001; every caller gets the error through its future
+            for future in batch.values():
+                future.set_exception(error)
+        else:
+            for key, future in batch.items():
+                future.set_result(profiles[key])
+        finally:
+            for key, future in batch.items():
+                if self._loading.get(key) is future:
+                    del self._loading[key]
+
+    @contextlib.contextmanager
+    def _writing(self, keys: Iterable[tuple[int, int]]) -> Iterator[None]:
+        # fetches that started before a write finished may not see it, so later reads can't share them
+        try:
+            yield
+        finally:
+            for key in keys:
+                self._loading.pop(key, None)
+
+    async def remove_profile(self, guild_id: int, user_id: int) -> None:
+        """Remove a profile from a specific guild.
+
+        Arguments:
+        ---------
+        guild_id (int): The guild that the user is in
+        user_id (int): This user whose profile is to be removed
+
+        """
+        with self._writing([(guild_id, user_id)]):
+            await self.database.remove_profile(guild_id, user_id)
+
+    async def remove_profiles(self, keys: Collection[tuple[int, int]]) -> None:
+        """Remove many profiles at once.
+
+        Arguments:
+        ---------
+        keys (Collection[tuple[int, int]]): The profiles to remove, as (guild_id, user_id)
+
+        """
+        with self._writing(keys):
+            await self.database.remove_profiles(keys)
+
+    async def purge_guild(self, guild_id: int) -> None:
+        """Remove every enabled channel, profile and sender snapshot of a guild.
+
+        Arguments:
+        ---------
+        guild_id (int): The guild to remove everything of
+
+        """
+        try:
+            await self.database.purge_guild(guild_id)
+        finally:
+            for key in [key for key in self._loading if key[0] == guild_id]:
+                del self._loading[key]
+
+    async def update_profile(self, guild_id: int, user_id: int, new_profile: UserProfile) -> None:
+        """Replace a profile with a new profile with updated values.
+
+        Arguments:
+        ---------
+        guild_id (int): The guild in which the profile is in
+        user_id (int): The user whose profile will be updated
+        new_profile (UserProfile): The new profile with updated values that is to be inserted.
+
+        """
+        with self._writing([(guild_id, user_id)]):
+            await self.database.update_profile(guild_id, user_id, new_profile)
+
+    async def add_coins(self, coins: Mapping[tuple[int, int], int]) -> None:
+        """Give coins to many users at once.
+
+        Arguments:
+        ---------
+        coins (Mapping[tuple[int, int], int]): How many coins to give, keyed by (guild_id, user_id)
+
+        """
+        with self._writing(coins):
+            await self.database.add_coins(coins)
+
+    async def upgrade_profile(
+        self, guild_id: int, user_id: int, profile: UserProfile, new_profile: UserProfile
+    ) -> UserProfile | None:
+        """Apply an upgrade that was priced from `profile`, in one step.
+
+        Arguments:
+        ---------
+        guild_id (int): The guild in which the profile is in
+        user_id (int): The user whose profile will be upgraded
+        profile (UserProfile): The profile that the upgrade was based on
+        new_profile (UserProfile): The profile after the upgrade
+
+        Returns the upgraded profile, or None if nothing changed.
+
+        """
+        with self._writing([(guild_id, user_id)]):
+            return await self.database.upgrade_profile(guild_id, user_id, profile, new_profile)
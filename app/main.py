@@ -1,6 +1,15 @@
+import asyncio
+import bisect
+import contextlib
+import datetime
+import hashlib
+import itertools
+import json
 import math
 import os
+import re
 import typing
+from collections.abc import Awaitable, Callable
 from enum import Enum, auto
 
 import discord
@@ -9,17 +18,36 @@ from discord import app_commands
 from discord.ui import Button, View
 
 from .async_database import open_database
-from .database import AbstractDatabase, MessagePriority, UserProfile
+from .cache import ProfileCache
+from .database import AbstractDatabase, MessagePriority, Ranking, UserProfile
+from .deleter import Deleter
+from .ledger import open_ledger
+from .loader import ProfileLoader
+from .metrics import TextMetrics
+from .sender import QueueFullError, checkpoint_senders, scheduler, senders
 from .sender import send as send_implementation
 
 dotenv.load_dotenv()
 TOKEN = os.environ["TOKEN"]
+# where to periodically write sender metrics, if anywhere
+METRICS_FILE = os.environ.get("METRICS_FILE")
+METRICS_INTERVAL = 15
+# how long to wait between resuming each sender that was interrupted by a restart
+RESUME_INTERVAL = 0.1
+# which of SHARD_COUNT shards this process connects to, or all of them if unset
+SHARD_COUNT = int(os.environ["SHARD_COUNT"]) if "SHARD_COUNT" in os.environ else None
+SHARD_IDS = [int(shard_id) for shard_id in os.environ["SHARD_IDS"].split(",")] if "SHARD_IDS" in os.environ else None
 PRIORITY_COST: dict[MessagePriority, int] = {
     MessagePriority.BOTTOM: 500,
     MessagePriority.MIDDLE: 2500,
     MessagePriority.TOP: -1,
 }
 MAXIMUM_CPS = 20000
+LEADERBOARD_PAGE_SIZE = 10
+# filled in with the ID of each command once they are synced
+DESCRIPTION = "Enable a channel with </config enable:{config}> and use </send:{send}> to send messages!"
+# the setting that remembers what was last synced, so that unchanged commands aren't synced again
+COMMANDS_HASH_SETTING = "commands_hash"
 PRIORITY_PIPELINE: list[MessagePriority] = list(PRIORITY_COST.keys())
 
 
@@ -34,18 +62,57 @@ class StatusCode(Enum):
     MAXIMUM_REACHED_BEFORE_COMPLETION = auto()
 
 
-def get_cps_cost(cur_cps: float) -> int:
-    """Get the cost to upgrade with the current cps."""
-    if cur_cps == MAXIMUM_CPS:
-        return -1
+def _compute_cps_cost(cur_cps: float) -> int:
+    """Calculate the cost to upgrade with the current cps."""
     cur_cps /= 10  # we store cps as e.g `11` instead of `1.1` for precision reasons
     cost = cur_cps * (math.pow(1.5, cur_cps / 30) - cur_cps / 5 + 30 - (20 / cur_cps) * math.sin(0.7 * cur_cps)) / 10
     return math.ceil(cost)
 
 
+# CPS_COST_TOTALS[cps] is the total cost of upgrading from 1 cps to `cps`
+CPS_COST_TOTALS: list[int] = [0, 0, *itertools.accumulate(map(_compute_cps_cost, range(1, MAXIMUM_CPS)))]
+
+
+def get_cps_cost(cur_cps: int) -> int:
+    """Get the cost to upgrade with the current cps."""
+    if cur_cps == MAXIMUM_CPS:
+        return -1
+    return CPS_COST_TOTALS[cur_cps + 1] - CPS_COST_TOTALS[cur_cps]
+
+
+def get_cps_upgrade_cost(cur_cps: int, levels: int) -> int:
+    """Get the cost to upgrade `levels` times with the current cps."""
+    return CPS_COST_TOTALS[cur_cps + levels] - CPS_COST_TOTALS[cur_cps]
+
+
+def get_affordable_cps_levels(cur_cps: int, coins: int) -> int:
+    """Get how many times someone can upgrade their cps with their coins."""
+    return bisect.bisect_right(CPS_COST_TOTALS, CPS_COST_TOTALS[cur_cps] + coins) - 1 - cur_cps
+
+
 Interaction: typing.TypeAlias = "discord.Interaction[DiscordClient]"
 
 
+def owns_guild(guild_id: int) -> bool:
+    """Check whether a guild is on one of this process's shards, so that its state belongs to this process."""
+    return SHARD_COUNT is None or SHARD_IDS is None or (guild_id >> 22) % SHARD_COUNT in SHARD_IDS
+
+
+def sender_callbacks(
+    database: AbstractDatabase, guild_id: int
+) -> tuple[Callable[[int], Awaitable[float]], Callable[[int, int], Awaitable[None]]]:
+    """Get the functions a sender uses to look up a user's cps and to pay them, in a guild."""
+
+    async def cps(user_id: int) -> float:
+        profile = await database.get_profile(guild_id, user_id)
+        return profile.cps / 10
+
+    async def add_coin(user_id: int, amount: int) -> None:
+        await database.add_coins({(guild_id, user_id): amount})
+
+    return cps, add_coin
+
+
 async def disabled_buttons(interaction: Interaction) -> set[str]:
     """Get all upgrade buttons that are impossible due to cost."""
     if not interaction.guild:
@@ -54,16 +121,12 @@ async def disabled_buttons(interaction: Interaction) -> set[str]:
     profile = await interaction.client.database.get_profile(interaction.guild.id, interaction.user.id)
     result = set()
 
-    if profile.coins < get_cps_cost(profile.cps):
+    affordable = get_affordable_cps_levels(profile.cps, profile.coins)
+    if affordable < 1:
         result.add("Upgrade CPS")
+        result.add("Upgrade CPS max")
+    if affordable < 10:  # noqa: PLR2004
         result.add("Upgrade CPS 10x")
-    else:
-        cost = 0
-        for cps in range(profile.cps, profile.cps + 10):
-            cost += get_cps_cost(cps)
-
-        if profile.coins < cost:
-            result.add("Upgrade CPS 10x")
 
     if profile.coins < PRIORITY_COST[profile.priority]:
         result.add("Upgrade Priority")
@@ -90,9 +153,8 @@ class UpgradeView(View):
             return
 
         await interaction.response.defer()
-        new_profile, status_code = await self._upgrade_cps(interaction)
+        status_code = await self._upgrade_cps(interaction)
         await self._handle_status_code(interaction, status_code)
-        await interaction.client.database.update_profile(interaction.guild.id, interaction.user.id, new_profile)
         await interaction.edit_original_response(
             embed=await self.create_embed(interaction), view=UpgradeView(await disabled_buttons(interaction))
         )
@@ -109,9 +171,8 @@ class UpgradeView(View):
             return
 
         await interaction.response.defer()
-        new_profile, status_code = await self._upgrade_priority(interaction)
+        status_code = await self._upgrade_priority(interaction)
         await self._handle_status_code(interaction, status_code)
-        await interaction.client.database.update_profile(interaction.guild.id, interaction.user.id, new_profile)
         await interaction.edit_original_response(
             embed=await self.create_embed(interaction), view=UpgradeView(await disabled_buttons(interaction))
         )
@@ -126,9 +187,24 @@ class UpgradeView(View):
             return
 
         await interaction.response.defer()
-        new_profile, status_code = await self._upgrade_cps(interaction, 10)
+        status_code = await self._upgrade_cps(interaction, 10)
+        await self._handle_status_code(interaction, status_code)
+        await interaction.edit_original_response(
+            embed=await self.create_embed(interaction), view=UpgradeView(await disabled_buttons(interaction))
+        )
+
+    @discord.ui.button(
+        label="Upgrade CPS max", style=discord.ButtonStyle.gray, row=1, custom_id="upgradepersistent:cpsmax"
+    )
+    async def cps_upgrade_max(self, interaction: Interaction, _: Button[typing.Self]) -> None:
+        """Upgrade CPS as many times as the user can afford."""
+        if not interaction.guild:
+            await interaction.response.send_message("This needs to be used in a guild")
+            return
+
+        await interaction.response.defer()
+        status_code = await self._upgrade_cps(interaction, MAXIMUM_CPS)
         await self._handle_status_code(interaction, status_code)
-        await interaction.client.database.update_profile(interaction.guild.id, interaction.user.id, new_profile)
         await interaction.edit_original_response(
             embed=await self.create_embed(interaction), view=UpgradeView(await disabled_buttons(interaction))
         )
@@ -179,61 +255,65 @@ class UpgradeView(View):
 
         return embed
 
-    async def _upgrade_priority(self, interaction: Interaction) -> tuple[UserProfile, StatusCode]:
+    async def _upgrade_priority(self, interaction: Interaction) -> StatusCode:
         """Upgrade the priority of the user."""
         if not interaction.guild:
             raise AssertionError
 
-        profile = await interaction.client.database.get_profile(interaction.guild.id, interaction.user.id)
-        priority_cost = PRIORITY_COST[profile.priority]
-        if profile.coins < priority_cost:
-            return (profile, StatusCode.NOT_ENOUGH_COINS)
-        if profile.priority == MessagePriority.TOP:
-            return (profile, StatusCode.MAXIMUM_REACHED)
-        new_coins = profile.coins - priority_cost
-        new_priority = PRIORITY_PIPELINE[PRIORITY_PIPELINE.index(profile.priority) + 1]
-        new_profile = UserProfile(coins=new_coins, priority=new_priority, cps=profile.cps)
-        return (new_profile, StatusCode.SUCCESS)
-
-    async def _upgrade_cps(self, interaction: Interaction, iterations: int = 1) -> tuple[UserProfile, StatusCode]:
+        database = interaction.client.database
+        while True:
+            profile = await database.get_profile(interaction.guild.id, interaction.user.id)
+            priority_cost = PRIORITY_COST[profile.priority]
+            if profile.coins < priority_cost:
+                return StatusCode.NOT_ENOUGH_COINS
+            if profile.priority == MessagePriority.TOP:
+                return StatusCode.MAXIMUM_REACHED
+            new_coins = profile.coins - priority_cost
+            new_priority = PRIORITY_PIPELINE[PRIORITY_PIPELINE.index(profile.priority) + 1]
+            new_profile = UserProfile(coins=new_coins, priority=new_priority, cps=profile.cps)
+            if (
+                await database.upgrade_profile(interaction.guild.id, interaction.user.id, profile, new_profile)
+                is not None
+            ):
+                return StatusCode.SUCCESS
+            # the profile changed since it was read, so price the upgrade again
+
+    async def _upgrade_cps(self, interaction: Interaction, iterations: int = 1) -> StatusCode:
         """Upgrade the cps of the user."""
         if not interaction.guild:
             raise AssertionError
 
-        profile = await interaction.client.database.get_profile(interaction.guild.id, interaction.user.id)
-        cps_cost = get_cps_cost(profile.cps)
-        reloop = False
-        new_coins = profile.coins
-        new_cps = profile.cps
-
-        for var in range(iterations):
-            if new_coins < cps_cost and not reloop:
-                return profile, StatusCode.NOT_ENOUGH_COINS
-            if new_coins < cps_cost and reloop:
-                await interaction.followup.send(
-                    f"Upgraded {var + 1} times before running out of coins.", ephemeral=True
-                )
-                return (
-                    UserProfile(coins=new_coins, cps=new_cps, priority=profile.priority),
-                    StatusCode.NOT_ENOUGH_COINS_BEFORE_COMPLETION,
-                )
-            if new_cps == MAXIMUM_CPS and not reloop:
-                return profile, StatusCode.MAXIMUM_REACHED
-            if new_cps == MAXIMUM_CPS and reloop:
-                await interaction.followup.send(
-                    f"Upgraded {var + 1} times before reaching maximum upgrade", ephemeral=True
-                )
-                return (
-                    UserProfile(coins=new_coins, cps=new_cps, priority=profile.priority),
-                    StatusCode.MAXIMUM_REACHED_BEFORE_COMPLETION,
-                )
-
-            new_coins -= cps_cost
-            new_cps += 1
-            cps_cost = get_cps_cost(new_cps)
-            reloop = True
-
-        return UserProfile(coins=new_coins, cps=new_cps, priority=profile.priority), StatusCode.SUCCESS
+        database = interaction.client.database
+        while True:
+            profile = await database.get_profile(interaction.guild.id, interaction.user.id)
+            if profile.cps == MAXIMUM_CPS:
+                return StatusCode.MAXIMUM_REACHED
+
+            affordable = get_affordable_cps_levels(profile.cps, profile.coins)
+            if affordable < 1:
+                return StatusCode.NOT_ENOUGH_COINS
+
+            levels = min(iterations, affordable, MAXIMUM_CPS - profile.cps)
+            new_profile = UserProfile(
+                coins=profile.coins - get_cps_upgrade_cost(profile.cps, levels),
+                cps=profile.cps + levels,
+                priority=profile.priority,
+            )
+            if (
+                await database.upgrade_profile(interaction.guild.id, interaction.user.id, profile, new_profile)
+                is not None
+            ):
+                break
+            # the profile changed since it was read, so price the upgrade again
+
+        if levels == iterations:
+            return StatusCode.SUCCESS
+        if new_profile.cps == MAXIMUM_CPS:
+            await interaction.followup.send(f"Upgraded {levels} times before reaching maximum upgrade", ephemeral=True)
+            return StatusCode.MAXIMUM_REACHED_BEFORE_COMPLETION
+
+        await interaction.followup.send(f"Upgraded {levels} times before running out of coins.", ephemeral=True)
+        return StatusCode.NOT_ENOUGH_COINS_BEFORE_COMPLETION
 
     async def _handle_status_code(self, interaction: Interaction, status_code: StatusCode) -> None:
         """Send an ephemeral message to the user upon completion of an upgrade, depending on status_code.
@@ -248,40 +328,170 @@ class UpgradeView(View):
             await interaction.followup.send("You already have the maximum upgrade for this category", ephemeral=True)
 
 
-class DiscordClient(discord.Client):
-    """Custom subclass of discord.py's Client for application commands."""
+async def leaderboard_page(
+    interaction: Interaction, ranking: Ranking, page: int, after: tuple[int, int] | None
+) -> tuple[discord.Embed, View]:
+    """Create the embed and buttons for a page of a guild's leaderboard."""
+    if not interaction.guild:
+        raise AssertionError
+
+    # one more than fits on the page, to know whether there is a next page
+    rows = await interaction.client.database.get_leaderboard(
+        interaction.guild.id, ranking, after, LEADERBOARD_PAGE_SIZE + 1
+    )
+    lines = []
+    for rank, (user_id, profile) in enumerate(rows[:LEADERBOARD_PAGE_SIZE], page * LEADERBOARD_PAGE_SIZE + 1):
+        value = profile.coins if ranking == Ranking.COINS else profile.cps / 10
+        lines.append(f"{rank}. <@{user_id}>: {value}")
+    embed = discord.Embed(
+        title=f"{"Coins" if ranking == Ranking.COINS else "CPS"} leaderboard",
+        description="\n".join(lines) or "Nobody is on this page.",
+    )
+
+    view = View(timeout=None)
+    if page:
+        view.add_item(LeaderboardButton(ranking, 0, None))
+    if len(rows) > LEADERBOARD_PAGE_SIZE:
+        user_id, profile = rows[LEADERBOARD_PAGE_SIZE - 1]
+        view.add_item(LeaderboardButton(ranking, page + 1, (getattr(profile, ranking), user_id)))
+
+    return embed, view
+
+
+class LeaderboardButton(
+    discord.ui.DynamicItem[Button[View]],
+    template=r"leaderboard:(?P<ranking>coins|cps):(?P<page>\d+)(?::(?P<value>\d+):(?P<user_id>\d+))?",
+):
+    """A button that goes to a page of the leaderboard, which keeps working after the bot restarts.
+
+    The page is stored in the button's custom_id, along with where the previous page ended.
+    """
+
+    def __init__(self, ranking: Ranking, page: int, after: tuple[int, int] | None) -> None:
+        custom_id = f"leaderboard:{ranking}:{page}"
+        if after is not None:
+            custom_id += f":{after[0]}:{after[1]}"
+        label = "Next" if page else "Top"
+        super().__init__(Button(label=label, style=discord.ButtonStyle.gray, custom_id=custom_id))
+        self.ranking = ranking
+        self.page = page
+        self.after = after
+
+    @classmethod
+    async def from_custom_id(
+        cls, _: discord.Interaction[typing.Any], __: discord.ui.Item[typing.Any], match: re.Match[str], /
+    ) -> typing.Self:
+        """Recreate a button from its custom_id."""
+        after = (int(match["value"]), int(match["user_id"])) if match["value"] else None
+        return cls(Ranking(match["ranking"]), int(match["page"]), after)
+
+    async def callback(self, interaction: discord.Interaction[typing.Any]) -> None:
+        """Show the page."""
+        if not interaction.guild:
+            await interaction.response.send_message("This needs to be used in a guild")
+            return
+
+        embed, view = await leaderboard_page(interaction, self.ranking, self.page, self.after)
+        await interaction.response.edit_message(embed=embed, view=view)
+
 
-    def __init__(self, *, intents: discord.Intents, db: AbstractDatabase) -> None:
-        super().__init__(intents=intents)
+class DiscordClient(discord.AutoShardedClient):
+    """Custom subclass of discord.py's AutoShardedClient for application commands."""
+
+    def __init__(
+        self,
+        *,
+        intents: discord.Intents,
+        db: AbstractDatabase,
+        shard_ids: list[int] | None = None,
+        shard_count: int | None = None,
+    ) -> None:
+        if shard_ids is None:
+            super().__init__(intents=intents, shard_count=shard_count)
+        else:
+            super().__init__(intents=intents, shard_ids=shard_ids, shard_count=shard_count)
 
         self.tree = app_commands.CommandTree(self)
         self.database = db
+        self.deleter = Deleter(self._delete_message, self._delete_messages, metrics=senders.metrics)
+
+    async def close(self) -> None:
+        """Finish deleting messages, then disconnect."""
+        await self.deleter.close()
+        await super().close()
+
+    # messages may have been deleted by someone else in the meantime
+    async def _delete_message(self, channel_id: int, message_id: int) -> None:
+        with contextlib.suppress(discord.NotFound):
+            await self.http.delete_message(channel_id, message_id)
+
+    async def _delete_messages(self, channel_id: int, message_ids: list[int]) -> None:
+        with contextlib.suppress(discord.NotFound):
+            await self.http.delete_messages(channel_id, [*message_ids])
+
+    def _commands_hash(self) -> str:
+        """Hash everything that syncing the commands and editing the description sends to Discord."""
+        commands = [command.to_dict(self.tree) for command in self.tree.get_commands(type=None)]
+        data = {"application": self.application_id, "commands": commands, "description": DESCRIPTION}
+        return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
 
     async def setup_hook(self) -> None:
         """Run async setup code before our bot connects.
 
-        Synchronizes our application commands with Discord and sets up the bot's description.
+        Synchronizes our application commands with Discord and sets up the bot's description,
+        unless neither changed since the last time.
+        These are global, so when running as several processes only the one with shard 0 does this.
         """
         self.add_view(UpgradeView())
+        self.add_dynamic_items(LeaderboardButton)
+        if self.shard_ids is not None and 0 not in self.shard_ids:
+            return
+
+        commands_hash = self._commands_hash()
+        if await self.database.get_setting(COMMANDS_HASH_SETTING) == commands_hash:
+            return
+
         app_commands = await self.tree.sync()
 
         command_id_map = {cmd.name: cmd.id for cmd in app_commands}
-        await (await self.application_info()).edit(
-            description=(
-                f"Enable a channel with </config enable:{command_id_map["config"]}> "
-                f"and use </send:{command_id_map["send"]}> to send messages!"
-            )
-        )
+        await (await self.application_info()).edit(description=DESCRIPTION.format_map(command_id_map))
+        await self.database.set_setting(COMMANDS_HASH_SETTING, commands_hash)
+
+    async def on_ready(self) -> None:
+        """Resume senders that were interrupted by a restart, a few at a time."""
+        for guild_id, channel_id in list(senders.snapshots):
+            # a channel that was used since is already restored
+            if (guild_id, channel_id) not in senders.snapshots:
+                continue
+
+            # threads and channels of guilds that aren't available yet aren't cached, so only Discord can tell
+            if self.get_channel(channel_id) is None:
+                try:
+                    await self.fetch_channel(channel_id)
+                except (discord.NotFound, discord.Forbidden):
+                    senders.snapshots.pop((guild_id, channel_id), None)
+                    continue
+                except discord.HTTPException:
+                    # kept, and restored when the channel is next used
+                    continue
+
+            channel = self.get_partial_messageable(channel_id, guild_id=guild_id)
+            cps, add_coin = sender_callbacks(self.database, guild_id)
+            scheduler.schedule(channel_id, senders[guild_id, channel_id], channel.send, cps, add_coin)
+            await asyncio.sleep(RESUME_INTERVAL)
 
     async def on_message(self, message: discord.Message) -> None:
         """Check every message to see if it should be deleted from an enabled channel."""
         if message.guild:
-            if message.author == self.user or message.channel.id not in await self.database.get_channels(
-                message.guild.id
-            ):
+            if message.author == self.user or not await self.database.is_enabled(message.guild.id, message.channel.id):
                 return
 
-            await message.delete()
+            self.deleter.delete(message.channel.id, message.id)
+
+    async def on_guild_remove(self, guild: discord.Guild) -> None:
+        """Forget everything about a guild that the bot was removed from."""
+        senders.forget_guild(guild.id)
+        await self.database.purge_guild(guild.id)
 
 
 class Config(app_commands.Group):
@@ -294,7 +504,7 @@ class Config(app_commands.Group):
             await interaction.response.send_message("This needs to be used in a guild")
             return
 
-        if interaction.channel.id in await interaction.client.database.get_channels(interaction.guild.id):
+        if await interaction.client.database.is_enabled(interaction.guild.id, interaction.channel.id):
             await interaction.response.send_message("The game is already enabled on this channel", ephemeral=True)
         else:
             await interaction.client.database.enable_channel(interaction.guild.id, interaction.channel.id)
@@ -307,7 +517,7 @@ class Config(app_commands.Group):
             await interaction.response.send_message("This needs to be used in a guild")
             return
 
-        if interaction.channel.id not in await interaction.client.database.get_channels(interaction.guild.id):
+        if not await interaction.client.database.is_enabled(interaction.guild.id, interaction.channel.id):
             await interaction.response.send_message("The game is already disabled on this channel")
         else:
             await interaction.client.database.disable_channel(interaction.guild.id, interaction.channel.id)
@@ -320,8 +530,7 @@ class Config(app_commands.Group):
             await interaction.response.send_message("This needs to be used in a guild")
             return
 
-        for channel_id in await interaction.client.database.get_channels(interaction.guild.id):
-            await interaction.client.database.disable_channel(interaction.guild.id, channel_id)
+        await interaction.client.database.disable_channels(interaction.guild.id)
         await interaction.response.send_message("Resetted all channels access")
 
 
@@ -336,35 +545,31 @@ async def send(interaction: Interaction, message: str) -> None:
         await interaction.response.send_message("This isn't possible")
         return
 
-    if interaction.channel.id not in await interaction.client.database.get_channels(interaction.guild.id):
+    if not await interaction.client.database.is_enabled(interaction.guild.id, interaction.channel.id):
         await interaction.response.send_message("Game is not enabled in this channel!")
         return
 
-    async def cps(user_id: int) -> float:
-        if not interaction.guild:
-            raise AssertionError
-
-        profile = await interaction.client.database.get_profile(interaction.guild.id, user_id)
-        return profile.cps / 10
-
-    async def add_coin(user_id: int) -> None:
-        if not interaction.guild:
-            raise AssertionError
-
-        profile = await interaction.client.database.get_profile(interaction.guild.id, user_id)
-        await interaction.client.database.update_profile(
+    cps, add_coin = sender_callbacks(interaction.client.database, interaction.guild.id)
+    profile = await interaction.client.database.get_profile(interaction.guild.id, interaction.user.id)
+    try:
+        wait = await send_implementation(
             interaction.guild.id,
-            user_id,
-            UserProfile(priority=profile.priority, coins=profile.coins + 1, cps=profile.cps),
+            interaction.channel.id,
+            interaction.user.id,
+            message,
+            interaction.channel.send,
+            cps,
+            add_coin,
+            profile.priority,
         )
-
-    if await send_implementation(
-        interaction.channel.id, interaction.user.id, message, interaction.channel.send, cps, add_coin
-    ):
-        await interaction.response.send_message("That is too much text to send at once.", ephemeral=True)
+    except QueueFullError as error:
+        await interaction.response.send_message(str(error), ephemeral=True)
         return
 
-    await interaction.response.send_message("Sent!", ephemeral=True)
+    done = discord.utils.utcnow() + datetime.timedelta(seconds=wait)
+    await interaction.response.send_message(
+        f"Sent! It should be done {discord.utils.format_dt(done, "R")}.", ephemeral=True
+    )
 
 
 async def upgrade(interaction: Interaction) -> None:
@@ -386,7 +591,7 @@ async def profile(interaction: Interaction, user: discord.User | None = None) ->
 
     person = user or interaction.user
 
-    if person.bot and interaction.channel.id in await interaction.client.database.get_channels(interaction.guild.id):
+    if person.bot and await interaction.client.database.is_enabled(interaction.guild.id, interaction.channel.id):
         await interaction.response.send_message("Bots cannot play the game :(", ephemeral=True)
         return
     if person.bot:
@@ -402,27 +607,67 @@ async def profile(interaction: Interaction, user: discord.User | None = None) ->
     embed.add_field(name="CPS", value=profile.cps / 10)
     embed.add_field(name="Message Priority", value=profile.priority.capitalize())
 
-    if interaction.channel.id in await interaction.client.database.get_channels(interaction.guild.id):
+    if await interaction.client.database.is_enabled(interaction.guild.id, interaction.channel.id):
         await interaction.response.send_message(embed=embed, ephemeral=True)
     else:
         await interaction.response.send_message(embed=embed)
 
 
+@app_commands.describe(ranking="What to rank users by. Defaults to coins")
+async def leaderboard(interaction: Interaction, ranking: Ranking = Ranking.COINS) -> None:
+    """See who has the most coins or characters per second."""
+    if not interaction.guild or not interaction.channel:
+        await interaction.response.send_message("This needs to be used in a guild")
+        return
+
+    embed, view = await leaderboard_page(interaction, ranking, 0, None)
+    if await interaction.client.database.is_enabled(interaction.guild.id, interaction.channel.id):
+        await interaction.response.send_message(embed=embed, view=view, ephemeral=True)
+    else:
+        await interaction.response.send_message(embed=embed, view=view)
+
+
 config = Config(
     name="config", description="Configures the game", default_permissions=discord.Permissions(manage_guild=True)
 )
 
 
+async def dump_metrics(metrics: TextMetrics, path: str) -> None:
+    """Write sender metrics to a file every so often, for scraping."""
+    while True:
+        await asyncio.sleep(METRICS_INTERVAL)
+        metrics.dump_to(path)
+
+
 async def main() -> None:
     """Async entrypoint for the bot."""
-    async with open_database("bot.db") as db:
-        client = DiscordClient(intents=discord.Intents.default(), db=db)
+    if METRICS_FILE:
+        senders.metrics = TextMetrics()
+        asyncio.create_task(dump_metrics(senders.metrics, METRICS_FILE))  # noqa: RUF006
+
+    async with (
+        open_database("bot.db") as db,
+        open_ledger(ProfileCache(ProfileLoader(db))) as ledger,
+        checkpoint_senders(ledger, owns=owns_guild),
+    ):
+        client = DiscordClient(
+            intents=discord.Intents.default(), db=ledger, shard_ids=SHARD_IDS, shard_count=SHARD_COUNT
+        )
+        senders.gone = (discord.NotFound,)
+        senders.messages = lambda channel_id, message_id: client.get_partial_messageable(
+            channel_id
+        ).get_partial_message(message_id)
 
         client.tree.command()(send)
         client.tree.command()(upgrade)
         client.tree.command(description="Check out your stats or another user's")(profile)
+        client.tree.command()(leaderboard)
         client.tree.add_command(config)
         discord.utils.setup_logging()
 
-        async with client:
-            await client.start(TOKEN)
+        try:
+            async with client:
+                await client.start(TOKEN)
+        finally:
+            # steps still give out coins and change senders, so they must end before the last checkpoint and flush
+            await scheduler.stop()
@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+import collections
+import pathlib
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .database import MessagePriority
+
+
+class SenderMetrics:
+    """Receives measurements from senders and the message deleter.
+
+    Every method does nothing, so this is a cheap default. Subclass it to record measurements.
+    """
+
+    def queue_depth(self, channel_id: int, users: int) -> None:
+        """Record how many users have characters queued in a channel."""
+
+    def buffered(self, channel_id: int, user_id: int, chars: int) -> None:
+        """Record how many characters a user has queued in a channel."""
+
+    def lag(self, channel_id: int, seconds: float) -> None:
+        """Record how late a sender woke up compared to when it was scheduled to."""
+
+    def request(self, channel_id: int, kind: str, seconds: float) -> None:
+        """Record how long a request to Discord took, where `kind` is "edit" or "send"."""
+
+    def emitted(self, channel_id: int, chars: int) -> None:
+        """Record that characters were emitted in a channel."""
+
+    def started(self, channel_id: int) -> None:
+        """Record that a channel's sender started sending after being idle."""
+
+    def rejected(self, channel_id: int, priority: MessagePriority) -> None:
+        """Record that a message was refused because too much was already queued."""
+
+    def failed(self, channel_id: int) -> None:
+        """Record that a channel's sender stopped because of an error."""
+
+    def deleted(self, channel_id: int, messages: int) -> None:
+        """Record that one request deleted some messages in a channel."""
+
+    def delete_dropped(self, channel_id: int) -> None:
+        """Record that a message was not deleted because too many were waiting to be."""
+
+
+class TextMetrics(SenderMetrics):
+    """Keeps sender measurements in memory and dumps them in the Prometheus text format."""
+
+    def __init__(self) -> None:
+        self.queue_depths: dict[int, int] = {}
+        self.buffers: dict[tuple[int, int], int] = {}
+        self.lag_count: dict[int, int] = collections.Counter()
+        self.lag_total: dict[int, float] = collections.defaultdict(float)
+        self.lag_max: dict[int, float] = collections.defaultdict(float)
+        self.request_count: dict[tuple[int, str], int] = collections.Counter()
+        self.request_total: dict[tuple[int, str], float] = collections.defaultdict(float)
+        self.emitted_total: dict[int, int] = collections.Counter()
+        self.started_total: dict[int, int] = collections.Counter()
+        self.failed_total: dict[int, int] = collections.Counter()
+        self.rejected_total: dict[tuple[int, MessagePriority], int] = collections.Counter()
+        self.delete_batch_count: dict[int, int] = collections.Counter()
+        self.delete_batch_total: dict[int, int] = collections.Counter()
+        self.delete_batch_max: dict[int, int] = collections.Counter()
+        self.delete_dropped_total: dict[int, int] = collections.Counter()
+
+    def queue_depth(self, channel_id: int, users: int) -> None:
+        """Record how many users have characters queued in a channel."""
+        if users:
+            self.queue_depths[channel_id] = users
+        else:
+            self.queue_depths.pop(channel_id, None)
+
+    def buffered(self, channel_id: int, user_id: int, chars: int) -> None:
+        """Record how many characters a user has queued in a channel."""
+        if chars:
+            self.buffers[channel_id, user_id] = chars
+        else:
+            self.buffers.pop((channel_id, user_id), None)
+
+    def lag(self, channel_id: int, seconds: float) -> None:
+        """Record how late a sender woke up compared to when it was scheduled to."""
+        self.lag_count[channel_id] += 1
+        self.lag_total[channel_id] += seconds
+        self.lag_max[channel_id] = max(self.lag_max[channel_id], seconds)
+
+    def request(self, channel_id: int, kind: str, seconds: float) -> None:
+        """Record how long a request to Discord took, where `kind` is "edit" or "send"."""
+        self.request_count[channel_id, kind] += 1
+        self.request_total[channel_id, kind] += seconds
+
+    def emitted(self, channel_id: int, chars: int) -> None:
+        """Record that characters were emitted in a channel."""
+        self.emitted_total[channel_id] += chars
+
+    def started(self, channel_id: int) -> None:
+        """Record that a channel's sender started sending after being idle."""
+        self.started_total[channel_id] += 1
+
+    def failed(self, channel_id: int) -> None:
+        """Record that a channel's sender stopped because of an error."""
+        self.failed_total[channel_id] += 1
+
+    def rejected(self, channel_id: int, priority: MessagePriority) -> None:
+        """Record that a message was refused because too much was already queued."""
+        self.rejected_total[channel_id, priority] += 1
+
+    def deleted(self, channel_id: int, messages: int) -> None:
+        """Record that one request deleted some messages in a channel."""
+        self.delete_batch_count[channel_id] += 1
+        self.delete_batch_total[channel_id] += messages
+        self.delete_batch_max[channel_id] = max(self.delete_batch_max[channel_id], messages)
+
+    def delete_dropped(self, channel_id: int) -> None:
+        """Record that a message was not deleted because too many were waiting to be."""
+        self.delete_dropped_total[channel_id] += 1
+
+    def dump(self) -> str:
+        """Get every measurement as text."""
+        return "".join(f"{line}\n" for line in [*self._sender_lines(), *self._deleter_lines()])
+
+    def _sender_lines(self) -> list[str]:
+        lines = []
+        for channel_id, users in self.queue_depths.items():
+            lines.append(f'sender_queue_depth{{channel="{channel_id}"}} {users}')
+        for (channel_id, user_id), chars in self.buffers.items():
+            lines.append(f'sender_buffered_chars{{channel="{channel_id}",user="{user_id}"}} {chars}')
+        for channel_id, count in self.lag_count.items():
+            lines.append(f'sender_lag_seconds_count{{channel="{channel_id}"}} {count}')
+            lines.append(f'sender_lag_seconds_sum{{channel="{channel_id}"}} {self.lag_total[channel_id]}')
+            lines.append(f'sender_lag_seconds_max{{channel="{channel_id}"}} {self.lag_max[channel_id]}')
+        for (channel_id, kind), count in self.request_count.items():
+            labels = f'channel="{channel_id}",kind="{kind}"'
+            lines.append(f"sender_request_seconds_count{{{labels}}} {count}")
+            lines.append(f"sender_request_seconds_sum{{{labels}}} {self.request_total[channel_id, kind]}")
+        for channel_id, chars in self.emitted_total.items():
+            lines.append(f'sender_emitted_chars_total{{channel="{channel_id}"}} {chars}')
+        for channel_id, count in self.started_total.items():
+            lines.append(f'sender_started_total{{channel="{channel_id}"}} {count}')
+        for channel_id, count in self.failed_total.items():
+            lines.append(f'sender_failed_total{{channel="{channel_id}"}} {count}')
+        for (channel_id, priority), count in self.rejected_total.items():
+            lines.append(f'sender_rejected_total{{channel="{channel_id}",priority="{priority}"}} {count}')
+        return lines
+
+    def _deleter_lines(self) -> list[str]:
+        lines = []
+        for channel_id, count in self.delete_batch_count.items():
+            lines.append(f'deleter_batch_size_count{{channel="{channel_id}"}} {count}')
+            lines.append(f'deleter_batch_size_sum{{channel="{channel_id}"}} {self.delete_batch_total[channel_id]}')
+            lines.append(f'deleter_batch_size_max{{channel="{channel_id}"}} {self.delete_batch_max[channel_id]}')
+        for channel_id, count in self.delete_dropped_total.items():
+            lines.append(f'deleter_dropped_total{{channel="{channel_id}"}} {count}')
+        return lines
+
+    def dump_to(self, path: str) -> None:
+        """Write every measurement to a file, replacing it all at once so readers never see half a dump."""
+        temporary = pathlib.Path(f"{path}.tmp")
+        temporary.write_text(self.dump())
+        temporary.replace(path)
@@ -1,39 +1,303 @@
 from __future__ import annotations
 
 import asyncio
+import bisect
 import collections
+import contextlib
 import dataclasses
 import heapq
-from typing import TYPE_CHECKING, Protocol
+import itertools
+import json
+import logging
+import math
+import time
+import zlib
+from typing import TYPE_CHECKING, Protocol, TypeAlias, TypedDict
+
+from .database import MessagePriority
+from .graphemes import grapheme_ends
+from .metrics import SenderMetrics
 
 if TYPE_CHECKING:
-    from collections.abc import Awaitable, Callable
+    from collections.abc import AsyncIterator, Awaitable, Callable, Iterable, Sequence
+
+    from .database import AbstractDatabase
+
+    _Job: TypeAlias = tuple[
+        "Sender",
+        Callable[[str], Awaitable["Editable"]],
+        Callable[[int], Awaitable[float]],
+        Callable[[int, int], Awaitable[None]],
+    ]
 
 
 MAX_MESSAGE_LENGTH = 2000
 MAX_QUEUE_TIME = 300
+# bounds on everything queued in a channel, in characters and in seconds at full capacity
+MAX_CHANNEL_BACKLOG = 20 * MAX_MESSAGE_LENGTH
+MAX_DRAIN_TIME = 60
+EDIT_INTERVAL = 1
+# Discord allows 5 requests every 5 seconds per channel
+RATELIMIT_REQUESTS = 5
+RATELIMIT_PERIOD = 5
+TICK_RESOLUTION = 0.05
+# how long to wait before stepping a sender again after a step fails, doubling with each failure in a row
+RETRY_DELAY = 1
+MAX_RETRY_DELAY = 60
+CHECKPOINT_INTERVAL = 30
+# how the sender's capacity is split between priorities when it is saturated
+PRIORITY_SHARES: dict[MessagePriority, int] = {
+    MessagePriority.TOP: 6,
+    MessagePriority.MIDDLE: 3,
+    MessagePriority.BOTTOM: 1,
+}
+# how much of a channel's backlog bounds each priority can fill, so lower priorities are turned away first
+ADMISSION_LIMITS: dict[MessagePriority, float] = {
+    MessagePriority.TOP: 1,
+    MessagePriority.MIDDLE: 0.75,
+    MessagePriority.BOTTOM: 0.5,
+}
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised when queueing a message would make a user's or a channel's backlog too long."""
+
+    def __init__(self, *, channel: bool) -> None:
+        super().__init__(
+            "This channel is too busy right now, try again later."
+            if channel
+            else "That is too much text to send at once."
+        )
+        self.channel = channel
 
 
 class Editable(Protocol):
     """Describes things that can be edited."""
 
+    @property
+    def id(self) -> int:
+        """The ID of the thing, so that it can be found again later."""
+
     async def edit(self, *, content: str) -> object:
         """Tell the thing to edit itself with some new content."""
 
 
+@dataclasses.dataclass
+class TextBuffer:
+    """Text that is consumed one grapheme cluster at a time from the front.
+
+    Text is split into clusters when it is added, so consuming a cluster only moves an offset forward.
+    The length of the buffer is the number of clusters left.
+    """
+
+    # each chunk of text with where its clusters end
+    _chunks: collections.deque[tuple[str, Sequence[int]]] = dataclasses.field(
+        init=False, default_factory=collections.deque
+    )
+    # clusters and characters consumed from the first chunk
+    _offset: int = dataclasses.field(init=False, default=0)
+    _start: int = dataclasses.field(init=False, default=0)
+    _length: int = dataclasses.field(init=False, default=0)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def append(self, text: str, ends: Sequence[int] | None = None) -> None:
+        """Add text to the end of the buffer, where `ends` is from `grapheme_ends` if already known."""
+        if text:
+            ends = grapheme_ends(text) if ends is None else ends
+            self._chunks.append((text, ends))
+            self._length += len(ends)
+
+    def content(self) -> str:
+        """Get what is left of the buffer as a string."""
+        if not self._chunks:
+            return ""
+
+        return self._chunks[0][0][self._start :] + "".join(text for text, _ in itertools.islice(self._chunks, 1, None))
+
+    def pop(self) -> str:
+        """Remove and return the first cluster."""
+        text, ends = self._chunks[0]
+        end = ends[self._offset]
+        cluster = text[self._start : end]
+        self._offset += 1
+        self._start = end
+        self._length -= 1
+        if self._offset == len(ends):
+            self._chunks.popleft()
+            self._offset = 0
+            self._start = 0
+        return cluster
+
+
+@dataclasses.dataclass
+class OutputBuffer:
+    """Text that is built up one character at a time, to be sent as messages."""
+
+    _parts: list[str] = dataclasses.field(init=False, default_factory=list)
+    _length: int = dataclasses.field(init=False, default=0)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def append(self, text: str) -> None:
+        """Add text to the end of the buffer."""
+        self._parts.append(text)
+        self._length += len(text)
+
+    def content(self) -> str:
+        """Get the whole buffer as a string."""
+        if len(self._parts) > 1:
+            self._parts[:] = ["".join(self._parts)]
+        return self._parts[0] if self._parts else ""
+
+    def split(self, length: int) -> str:
+        """Remove and return at most `length` characters from the start, without splitting a grapheme cluster."""
+        content = self.content()
+        # clusters are found from the start, so the ones that end within `length` don't depend on the rest
+        ends = grapheme_ends(content[: length + 1])
+        # a single cluster longer than `length` has to be split anyway
+        cut = ends[bisect.bisect_right(ends, length) - 1] if ends[0] <= length else length
+        rest = content[cut:]
+        self._parts[:] = [rest] if rest else []
+        self._length = len(rest)
+        return content[:cut]
+
+
+@dataclasses.dataclass
+class RateLimit:
+    """A budget of `requests` requests every `period` seconds."""
+
+    requests: int = RATELIMIT_REQUESTS
+    period: float = RATELIMIT_PERIOD
+    _sent: collections.deque[float] = dataclasses.field(init=False, default_factory=collections.deque)
+
+    def available_at(self) -> float:
+        """Get when the next request can be made."""
+        if len(self._sent) < self.requests:
+            return -math.inf
+        return self._sent[0] + self.period
+
+    def _expire(self, now: float) -> None:
+        while self._sent and self._sent[0] + self.period <= now:
+            self._sent.popleft()
+
+    def acquire(self, now: float) -> bool:
+        """Use up a request if the budget allows it."""
+        self._expire(now)
+        if len(self._sent) >= self.requests:
+            return False
+
+        self._sent.append(now)
+        return True
+
+    def spacing(self, now: float, interval: float) -> float:
+        """Get how long to wait before the next request, so what is left of the budget is spread out evenly.
+
+        This is never less than `interval`, but is more when recent requests used up most of the budget.
+        """
+        self._expire(now)
+        if not self._sent:
+            return interval
+
+        # the remaining requests, and then the first one that comes back, are spaced out until it comes back
+        remaining = self.requests - len(self._sent)
+        return max(interval, (self._sent[0] + self.period - now) / (max(remaining, 0) + 1))
+
+
+@dataclasses.dataclass
+class PriorityStats:
+    """How long characters of one priority waited past when they were due."""
+
+    emitted: int = 0
+    total_delay: float = 0
+    max_delay: float = 0
+
+    def record(self, delay: float) -> None:
+        """Record that a character was emitted `delay` seconds after it was due."""
+        self.emitted += 1
+        self.total_delay += delay
+        self.max_delay = max(self.max_delay, delay)
+
+    @property
+    def mean_delay(self) -> float:
+        """Get the average delay of emitted characters."""
+        return self.total_delay / self.emitted if self.emitted else 0
+
+
+class SenderState(TypedDict):
+    """Everything a sender has yet to send, in a form that can be saved across restarts."""
+
+    # (user_id, priority, seconds until their next character is due, their queued text)
+    queued: list[tuple[int, str, float, str]]
+    output: str
+    segments: list[str]
+    last: int | None
+
+
 @dataclasses.dataclass
 class Sender:
-    """Storage for messages that are to be sent out slowly."""
+    """Storage for messages that are to be sent out slowly.
+
+    If `batched` is set, the sender only wakes up when it is time to edit the message,
+    emitting every character that became due since the last edit at once.
+
+    Output that doesn't fit in one message is cut into full messages, which are sent
+    in order as `ratelimit` allows.
+
+    Everything emitted between flushes is coalesced into one edit, and flushes are at least
+    `edit_interval` apart. They are spaced out further when little of `ratelimit` is left, and
+    whatever is left over once nothing else is queued is always flushed.
+
+    In batched mode, at most `capacity` characters per second are emitted. When more than that
+    are due, each priority gets a part of the capacity proportional to its entry in `shares`.
+
+    Messages are refused once the characters queued in the channel would go over `max_backlog`,
+    or would take longer than `max_drain_time` to emit at `capacity`. Each priority can only fill
+    its entry in `admission` of those bounds.
+
+    A message that editing fails on with one of `gone` is taken to be deleted, and its content
+    is sent as a new message instead.
+    """
 
-    _queue: list[tuple[float, int]] = dataclasses.field(init=False, default_factory=list)
+    batched: bool = False
+    channel_id: int = 0
+    guild_id: int = 0
+    metrics: SenderMetrics = dataclasses.field(default_factory=SenderMetrics)
+    edit_interval: float = EDIT_INTERVAL
+    ratelimit: RateLimit = dataclasses.field(default_factory=RateLimit)
+    capacity: float = MAX_MESSAGE_LENGTH * RATELIMIT_REQUESTS / RATELIMIT_PERIOD
+    shares: dict[MessagePriority, int] = dataclasses.field(default_factory=lambda: dict(PRIORITY_SHARES))
+    max_backlog: float = MAX_CHANNEL_BACKLOG
+    max_drain_time: float = MAX_DRAIN_TIME
+    admission: dict[MessagePriority, float] = dataclasses.field(default_factory=lambda: dict(ADMISSION_LIMITS))
+    gone: tuple[type[Exception], ...] = ()
+    stats: dict[MessagePriority, PriorityStats] = dataclasses.field(
+        init=False, default_factory=lambda: {priority: PriorityStats() for priority in MessagePriority}
+    )
+    _queues: dict[MessagePriority, list[tuple[float, int]]] = dataclasses.field(
+        init=False, default_factory=lambda: {priority: [] for priority in MessagePriority}
+    )
+    _priorities: dict[int, MessagePriority] = dataclasses.field(init=False, default_factory=dict)
     _started: bool = dataclasses.field(init=False, default=False)
-    _buffers: dict[int, str] = dataclasses.field(init=False, default_factory=dict)
+    _buffers: dict[int, TextBuffer] = dataclasses.field(init=False, default_factory=dict)
+    # characters left in every buffer
+    _backlog: int = dataclasses.field(init=False, default=0)
+    _output: OutputBuffer = dataclasses.field(init=False, default_factory=OutputBuffer)
+    _segments: collections.deque[str] = dataclasses.field(init=False, default_factory=collections.deque)
+    _dirty: bool = dataclasses.field(init=False, default=False)
+    _last: Editable | None = dataclasses.field(init=False, default=None)
+    _next_flush: float = dataclasses.field(init=False, default=-math.inf)
+    _last_step: float = dataclasses.field(init=False, default=-math.inf)
 
     async def start(
         self,
         send: Callable[[str], Awaitable[Editable]],
         cps: Callable[[int], Awaitable[float]],
-        add_coin: Callable[[int], Awaitable[None]],
+        add_coin: Callable[[int, int], Awaitable[None]],
     ) -> None:
         """Task to send out messages slowly.
 
@@ -44,74 +308,528 @@ class Sender:
             return
 
         self._started = True
+        self.metrics.started(self.channel_id)
+        try:
+            if self.batched:
+                await self._send_batched(send, cps, add_coin)
+            else:
+                await self._send_each(send, cps, add_coin)
+        except Exception:
+            self.metrics.failed(self.channel_id)
+            raise
+        finally:
+            self._started = False
+
+    async def _send_each(
+        self,
+        send: Callable[[str], Awaitable[Editable]],
+        cps: Callable[[int], Awaitable[float]],
+        add_coin: Callable[[int, int], Awaitable[None]],
+    ) -> None:
+        """Wake up for every character that is due."""
         loop = asyncio.get_running_loop()
-        buffer = ""
-        last: Editable | None = None
-        last_send = loop.time() - 1
 
-        while self._queue:
-            when, who = heapq.heappop(self._queue)
+        while self.pending():
+            if (priority := self._next_priority()) is None:
+                # nothing else is queued, but the end of the output still has to go out
+                await asyncio.sleep(self.next_wakeup() - loop.time())
+                await self._flush(send)
+                continue
+
+            when, who = heapq.heappop(self._queues[priority])
             await asyncio.sleep(when - loop.time())
+            self.metrics.lag(self.channel_id, loop.time() - when)
 
-            char = self._buffers[who][0]  # should this split on graphenes instead?
-            buffer += char
-
-            if loop.time() >= last_send + 1:
-                # send the new buffer
-                last_send = loop.time()
-                if last and len(buffer) <= MAX_MESSAGE_LENGTH:
-                    await last.edit(content=buffer)
-                elif last:
-                    await last.edit(content=buffer[:MAX_MESSAGE_LENGTH])
-                    if len(buffer) > 2 * MAX_MESSAGE_LENGTH:
-                        # this is possible if there are many people sending messages
-                        # (or high enough cps rates), but is a complicated case to deal with
-                        # because of Discord's ratelimits. (which are 5/5s)
-                        raise NotImplementedError
-                    buffer = buffer[MAX_MESSAGE_LENGTH:]
-                    last = None
-
-                if last is None:
-                    last = await send(buffer)
+            self._output.append(self._buffers[who].pop())
+            self._backlog -= 1
+            self._dirty = True
+            self.stats[priority].record(loop.time() - when)
+            self.metrics.emitted(self.channel_id, 1)
+
+            if loop.time() >= self._next_flush:
+                await self._flush(send)
 
             new_cps = await cps(who)
-            await add_coin(who)
-            if len(self._buffers[who]) > 1:
-                heapq.heappush(self._queue, (when + 1 / new_cps, who))
-                self._buffers[who] = self._buffers[who][1:]
+            await add_coin(who, 1)
+            if self._buffers[who]:
+                heapq.heappush(self._queues[self._priorities[who]], (when + 1 / new_cps, who))
+                self.metrics.buffered(self.channel_id, who, len(self._buffers[who]))
             else:
                 del self._buffers[who]
+                del self._priorities[who]
+                self.metrics.buffered(self.channel_id, who, 0)
+                self.metrics.queue_depth(self.channel_id, len(self._buffers))
 
-        self._started = False
+    async def _send_batched(
+        self,
+        send: Callable[[str], Awaitable[Editable]],
+        cps: Callable[[int], Awaitable[float]],
+        add_coin: Callable[[int, int], Awaitable[None]],
+    ) -> None:
+        """Wake up once per edit, emitting characters in the order they became due."""
+        loop = asyncio.get_running_loop()
 
-    def add_item(self, who: int, cps: float, what: str) -> bool:
-        """Add a message to a queue to be sent."""
+        while self.pending():
+            wakeup = self.next_wakeup()
+            await asyncio.sleep(wakeup - loop.time())
+            self.metrics.lag(self.channel_id, loop.time() - wakeup)
+            await self.step(send, cps, add_coin)
+
+    def _next_priority(
+        self, now: float = math.inf, among: Iterable[MessagePriority] = tuple(MessagePriority)
+    ) -> MessagePriority | None:
+        """Get the priority whose next character is due first, if any are due by `now`."""
+        best = None
+        for priority in among:
+            queue = self._queues[priority]
+            if queue and queue[0][0] <= now and (best is None or queue[0] < self._queues[best][0]):
+                best = priority
+        return best
+
+    def next_wakeup(self) -> float:
+        """Get when characters should next be emitted or sent in batched mode."""
+        wakeup = math.inf
+        if (priority := self._next_priority()) is not None:
+            wakeup = max(self._queues[priority][0][0], self._next_flush)
+        if self._segments or self._dirty:
+            wakeup = min(wakeup, max(self._next_flush, self.ratelimit.available_at()))
+        return wakeup
+
+    async def step(
+        self,
+        send: Callable[[str], Awaitable[Editable]],
+        cps: Callable[[int], Awaitable[float]],
+        add_coin: Callable[[int, int], Awaitable[None]],
+    ) -> None:
+        """Emit every character that is due and edit the message, as one batch."""
+        now = asyncio.get_running_loop().time()
+        # output that is still waiting on the ratelimit counts against this step
+        budget = self.capacity * min(now - self._last_step, self.edit_interval) - sum(map(len, self._segments))
+        self._last_step = now
+        rates: dict[int, float] = {}
+        earned: dict[int, int] = collections.Counter()
+
+        while budget >= 1:
+            due = [priority for priority, queue in self._queues.items() if queue and queue[0][0] <= now]
+            if not due:
+                break
+
+            # quota left over by priorities that run out of due characters is shared out again next round
+            total_shares = sum(self.shares[priority] for priority in due)
+            quotas = {priority: max(1, int(budget * self.shares[priority] / total_shares)) for priority in due}
+            # characters still come out in the order they became due, as long as their priority has quota left
+            while quotas and (priority := self._next_priority(now, quotas)) is not None:
+                quotas[priority] -= 1
+                if not quotas[priority]:
+                    del quotas[priority]
+                budget -= 1
+                when, who = heapq.heappop(self._queues[priority])
+                self._output.append(self._buffers[who].pop())
+                self._dirty = True
+                self.stats[priority].record(now - when)
+                earned[who] += 1
+
+                if self._buffers[who]:
+                    if who not in rates:
+                        rates[who] = await cps(who)
+                    heapq.heappush(self._queues[self._priorities[who]], (when + 1 / rates[who], who))
+                else:
+                    del self._buffers[who]
+                    del self._priorities[who]
+
+        if earned:
+            self._backlog -= sum(earned.values())
+            self.metrics.emitted(self.channel_id, sum(earned.values()))
+            self.metrics.queue_depth(self.channel_id, len(self._buffers))
+            for who in earned:
+                self.metrics.buffered(self.channel_id, who, len(self._buffers[who]) if who in self._buffers else 0)
+
+        try:
+            await self._flush(send)
+        finally:
+            # the characters are in the output either way, and go out with a later flush if this one fails
+            for who, amount in earned.items():
+                await add_coin(who, amount)
+
+    async def _flush(self, send: Callable[[str], Awaitable[Editable]]) -> None:
+        """Send the new buffer, as far as the ratelimit allows."""
+        now = asyncio.get_running_loop().time()
+        while len(self._output) > MAX_MESSAGE_LENGTH:
+            self._segments.append(self._output.split(MAX_MESSAGE_LENGTH))
+
+        # full messages go out first, the first one replacing whatever was last sent
+        while self._segments:
+            if not self._acquire(now):
+                return
+
+            # only dropped once it is sent, so a failed request is tried again
+            await self._update(send, self._segments[0])
+            self._last = None
+            self._segments.popleft()
+
+        if not self._output:
+            self._dirty = False
+        if not self._dirty or not self._acquire(now):
+            return
+
+        self._dirty = False
+        try:
+            self._last = await self._update(send, self._output.content())
+        except BaseException:
+            self._dirty = True
+            raise
+
+    def _acquire(self, now: float) -> bool:
+        """Use up a request if the ratelimit allows it, pushing back the next flush."""
+        if not self.ratelimit.acquire(now):
+            return False
+
+        self._next_flush = now + self.ratelimit.spacing(now, self.edit_interval)
+        return True
+
+    async def _update(self, send: Callable[[str], Awaitable[Editable]], content: str) -> Editable:
+        """Edit the last message to `content`, or send a new one if there is none or it was deleted."""
+        if self._last:
+            try:
+                await self._edit(self._last, content)
+            except self.gone:
+                self._last = None
+            else:
+                return self._last
+        return await self._send(send, content)
+
+    async def _edit(self, message: Editable, content: str) -> None:
+        start = time.perf_counter()
+        await message.edit(content=content)
+        self.metrics.request(self.channel_id, "edit", time.perf_counter() - start)
+
+    async def _send(self, send: Callable[[str], Awaitable[Editable]], content: str) -> Editable:
+        start = time.perf_counter()
+        message = await send(content)
+        self.metrics.request(self.channel_id, "send", time.perf_counter() - start)
+        return message
+
+    def pending(self) -> bool:
+        """Check whether there are characters or messages left to send."""
+        return bool(self._buffers or self._segments or self._dirty)
+
+    def snapshot(self) -> SenderState:
+        """Get everything that is left to send, with due times relative to now."""
+        now = asyncio.get_running_loop().time()
+        # a user's entry is briefly off the queue while they are being emitted, in which case they are due now
+        due = {who: when for queue in self._queues.values() for when, who in queue}
+        return {
+            "queued": [
+                (who, str(self._priorities[who]), due.get(who, now) - now, buffer.content())
+                for who, buffer in self._buffers.items()
+                if buffer
+            ],
+            "output": self._output.content(),
+            "segments": list(self._segments),
+            "last": self._last.id if self._last else None,
+        }
+
+    def restore(self, state: SenderState, last: Editable | None = None) -> None:
+        """Pick up from a snapshot, where `last` is the message the snapshot was editing."""
+        now = asyncio.get_running_loop().time()
+        for who, priority, delay, text in state["queued"]:
+            self._priorities[who] = MessagePriority(priority)
+            heapq.heappush(self._queues[self._priorities[who]], (now + delay, who))
+            self._buffers[who] = TextBuffer()
+            self._buffers[who].append(text)
+            self._backlog += len(self._buffers[who])
+            self.metrics.buffered(self.channel_id, who, len(self._buffers[who]))
+
+        if state["output"]:
+            self._output.append(state["output"])
+        self._segments.extend(state["segments"])
+        self._last = last
+        # the message may not have caught up with the output before the snapshot
+        self._dirty = bool(self._output)
+        # edits are spaced out from here, as if the message had just been edited
+        self._next_flush = now + self.edit_interval
+        self.metrics.queue_depth(self.channel_id, len(self._buffers))
+
+    def add_item(self, who: int, cps: float, what: str, priority: MessagePriority = MessagePriority.BOTTOM) -> float:
+        """Add a message to a queue to be sent, getting roughly how many seconds until all of it is.
+
+        Raises QueueFullError if the user or the channel already has too much queued.
+        """
         loop = asyncio.get_running_loop()
 
-        if (len(self._buffers.get(who, "")) + len(what)) / cps > MAX_QUEUE_TIME:
-            return True
-        if who in self._buffers:
-            self._buffers[who] = self._buffers[who] + what
+        buffer = self._buffers.get(who)
+        ends = grapheme_ends(what)
+        queued = (len(buffer) if buffer else 0) + len(ends)
+        if queued / cps > MAX_QUEUE_TIME:
+            self.metrics.rejected(self.channel_id, priority)
+            raise QueueFullError(channel=False)
+
+        backlog = self._backlog + len(ends)
+        limit = self.admission[priority]
+        if backlog > self.max_backlog * limit or backlog / self.capacity > self.max_drain_time * limit:
+            self.metrics.rejected(self.channel_id, priority)
+            raise QueueFullError(channel=True)
+
+        # takes effect from the next character that is queued
+        self._priorities[who] = priority
+        if buffer is None:
+            heapq.heappush(self._queues[priority], (loop.time() + 1 / cps, who))
+            buffer = self._buffers[who] = TextBuffer()
+            self.metrics.queue_depth(self.channel_id, len(self._buffers))
+        buffer.append(what, ends)
+        self._backlog = backlog
+        self.metrics.buffered(self.channel_id, who, len(buffer))
+        # a busy channel is slowed down by everyone else's characters too
+        return max(queued / cps, backlog / self.capacity)
+
+
+@dataclasses.dataclass
+class Scheduler:
+    """Drives batched senders for every channel from a single timer.
+
+    Wakeup times are rounded up to a multiple of `resolution`, so all senders due in the same
+    slot are handled by one wakeup no matter how many channels are active.
+
+    Due senders are stepped right away by the scheduler's task. A step only becomes a task of
+    its own if it has to wait, usually on a request to Discord, which `spawned` counts.
+    """
+
+    resolution: float = TICK_RESOLUTION
+    wakeups: int = dataclasses.field(init=False, default=0)
+    spawned: int = dataclasses.field(init=False, default=0)
+    _heap: list[tuple[float, int]] = dataclasses.field(init=False, default_factory=list)
+    _scheduled: dict[int, float] = dataclasses.field(init=False, default_factory=dict)
+    # the task of each step in progress, or None while it is still being run inline
+    _running: dict[int, asyncio.Task[None] | None] = dataclasses.field(init=False, default_factory=dict)
+    # how many steps in a row failed for each channel, and when it may be stepped again
+    _backoff: dict[int, tuple[int, float]] = dataclasses.field(init=False, default_factory=dict)
+    _jobs: dict[int, _Job] = dataclasses.field(init=False, default_factory=dict)
+    _tasks: set[asyncio.Task[None]] = dataclasses.field(init=False, default_factory=set)
+    _wakeup: asyncio.Event = dataclasses.field(init=False, default_factory=asyncio.Event)
+    _task: asyncio.Task[None] | None = dataclasses.field(init=False, default=None)
+
+    def schedule(  # noqa: PLR0913; the alternative is worse
+        self,
+        channel_id: int,
+        sender: Sender,
+        send: Callable[[str], Awaitable[Editable]],
+        cps: Callable[[int], Awaitable[float]],
+        add_coin: Callable[[int, int], Awaitable[None]],
+    ) -> None:
+        """Make sure a channel's sender will be stepped once it has characters due."""
+        if channel_id not in self._jobs:
+            sender.metrics.started(channel_id)
+        self._jobs[channel_id] = (sender, send, cps, add_coin)
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+        if channel_id not in self._running:
+            self._reschedule(channel_id)
+
+    def _reschedule(self, channel_id: int) -> None:
+        sender = self._jobs[channel_id][0]
+        if not sender.pending():
+            del self._jobs[channel_id]
+            self._backoff.pop(channel_id, None)
+            return
+
+        wakeup = max(sender.next_wakeup(), self._backoff.get(channel_id, (0, -math.inf))[1])
+        when = math.ceil(wakeup / self.resolution) * self.resolution
+        if when < self._scheduled.get(channel_id, math.inf):
+            # any later entry for this channel is skipped when it is popped
+            self._scheduled[channel_id] = when
+            if not self._heap or when < self._heap[0][0]:
+                self._wakeup.set()
+            heapq.heappush(self._heap, (when, channel_id))
+
+    async def _step(self, channel_id: int) -> None:
+        job = self._jobs[channel_id]
+        sender, send, cps, add_coin = job
+        try:
+            await sender.step(send, cps, add_coin)
+        except asyncio.CancelledError:
+            # the channel may have been scheduled again while the step was waiting
+            if self._jobs.get(channel_id) is job:
+                del self._jobs[channel_id]
+            raise
+        except Exception:
+            # a failed request to Discord is usually temporary, so the sender is tried again later
+            failures = self._backoff.get(channel_id, (0, -math.inf))[0] + 1
+            delay = min(RETRY_DELAY * 2 ** (failures - 1), MAX_RETRY_DELAY)
+            self._backoff[channel_id] = (failures, asyncio.get_running_loop().time() + delay)
+            sender.metrics.failed(channel_id)
+            logger.exception("Stepping the sender of channel %d failed, retrying in %ss", channel_id, delay)
         else:
-            heapq.heappush(self._queue, (loop.time() + 1 / cps, who))
-            self._buffers[who] = what
-        return False
+            self._backoff.pop(channel_id, None)
+        finally:
+            self._running.pop(channel_id, None)
+
+        if channel_id in self._jobs:
+            self._reschedule(channel_id)
+
+    def cancel(self, channel_id: int) -> None:
+        """Stop stepping a channel's sender, cancelling its step if one is in progress."""
+        self._jobs.pop(channel_id, None)
+        self._backoff.pop(channel_id, None)
+        # its entry in the heap is skipped when it is popped
+        self._scheduled.pop(channel_id, None)
+        if (task := self._running.pop(channel_id, None)) is not None:
+            task.cancel()
+
+    async def stop(self) -> None:
+        """Stop stepping senders, cancelling steps that are in progress and waiting for them to finish."""
+        tasks = [*self._tasks] if self._task is None else [self._task, *self._tasks]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+
+    async def run(self) -> None:
+        """Step every sender when it is due, forever."""
+        loop = asyncio.get_running_loop()
+
+        while True:
+            self._wakeup.clear()
+            delay = self._heap[0][0] - loop.time() if self._heap else None
+            if delay is None or delay > 0:
+                with contextlib.suppress(TimeoutError):
+                    async with asyncio.timeout(delay):
+                        await self._wakeup.wait()
+                continue
+
+            self.wakeups += 1
+            now = loop.time()
+            # collected first, since steps can schedule their channel again
+            due = []
+            while self._heap and self._heap[0][0] <= now:
+                when, channel_id = heapq.heappop(self._heap)
+                if self._scheduled.get(channel_id) != when:
+                    continue
+
+                del self._scheduled[channel_id]
+                self._running[channel_id] = None
+                self._jobs[channel_id][0].metrics.lag(channel_id, now - when)
+                due.append(channel_id)
 
+            for channel_id in due:
+                # runs the step until it first has to wait, without a trip through the event loop
+                task = asyncio.Task(self._step(channel_id), loop=loop, eager_start=True)
+                if not task.done():
+                    self.spawned += 1
+                    self._running[channel_id] = task
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
 
-senders: dict[int, Sender] = collections.defaultdict(Sender)
+
+class SenderRegistry(dict[tuple[int, int], Sender]):
+    """Senders by (guild_id, channel_id), created when they are first used.
+
+    Senders in `snapshots` are restored when their channel is first used, so a restart
+    doesn't have to restore every channel up front.
+    """
+
+    def __init__(self, metrics: SenderMetrics | None = None, scheduler: Scheduler | None = None) -> None:
+        super().__init__()
+        self.metrics = metrics or SenderMetrics()
+        # what editing a deleted message raises, given to every sender
+        self.gone: tuple[type[Exception], ...] = ()
+        # the scheduler that steps these senders, if any
+        self.scheduler = scheduler
+        self.snapshots: dict[tuple[int, int], bytes] = {}
+        # finds the message a restored sender was editing, by channel_id and message id
+        self.messages: Callable[[int, int], Editable] | None = None
+
+    def __missing__(self, key: tuple[int, int]) -> Sender:
+        guild_id, channel_id = key
+        sender = self[key] = Sender(
+            batched=True, channel_id=channel_id, guild_id=guild_id, metrics=self.metrics, gone=self.gone
+        )
+        if (snapshot := self.snapshots.pop(key, None)) is not None:
+            state: SenderState = json.loads(zlib.decompress(snapshot))
+            last = state["last"]
+            sender.restore(state, self.messages(channel_id, last) if last is not None and self.messages else None)
+        return sender
+
+    def snapshot(self) -> dict[tuple[int, int], bytes]:
+        """Get a compressed snapshot of every sender that has something left to send, by (guild_id, channel_id)."""
+        # snapshots that haven't been restored yet are still needed
+        snapshots = dict(self.snapshots)
+        for key, sender in self.items():
+            if sender.pending():
+                state = json.dumps(sender.snapshot(), separators=(",", ":"))
+                snapshots[key] = zlib.compress(state.encode())
+        return snapshots
+
+    def forget_guild(self, guild_id: int) -> None:
+        """Drop the senders and snapshots of a guild, so they are neither stepped nor checkpointed again."""
+        for key in [key for key in self if key[0] == guild_id]:
+            if self.scheduler is not None:
+                self.scheduler.cancel(key[1])
+            del self[key]
+        for key in [key for key in self.snapshots if key[0] == guild_id]:
+            del self.snapshots[key]
+
+
+scheduler = Scheduler()
+senders = SenderRegistry(scheduler=scheduler)
 
 
 async def send(  # noqa: PLR0913; the alternative is worse
+    guild_id: int,
     channel_id: int,
     who: int,
     what: str,
     send: Callable[[str], Awaitable[Editable]],
     cps: Callable[[int], Awaitable[float]],
-    add_coin: Callable[[int], Awaitable[None]],
-) -> bool:
-    """Add a message to a queue of messages to be sent, potentially starting a new queue."""
-    if senders[channel_id].add_item(who, await cps(who), f"{what}\n") is True:
-        return True
+    add_coin: Callable[[int, int], Awaitable[None]],
+    priority: MessagePriority = MessagePriority.BOTTOM,
+) -> float:
+    """Add a message to a queue of messages to be sent, making sure the channel gets scheduled.
+
+    Returns roughly how many seconds until all of it is sent, or raises QueueFullError if it can't be queued.
+    """
+    sender = senders[guild_id, channel_id]
+    wait = sender.add_item(who, await cps(who), f"{what}\n", priority)
+    scheduler.schedule(channel_id, sender, send, cps, add_coin)
+    return wait
+
+
+@contextlib.asynccontextmanager
+async def checkpoint_senders(
+    database: AbstractDatabase, interval: float = CHECKPOINT_INTERVAL, owns: Callable[[int], bool] | None = None
+) -> AsyncIterator[SenderRegistry]:
+    """Load sender snapshots from a database, saving them back periodically and on exit.
+
+    Only snapshots of guilds that this process owns are touched, so processes can share a database.
+
+    Arguments:
+    ---------
+    database (AbstractDatabase): The database to keep snapshots in
+    interval (float): How many seconds to wait between checkpoints
+    owns (Callable[[int], bool] | None): Whether a guild belongs to this process, if not all of them do
+
+    """
+    senders.snapshots.update(
+        (key, state) for key, state in (await database.load_snapshots()).items() if owns is None or owns(key[0])
+    )
+    saved = set(senders.snapshots)
+
+    async def checkpoint() -> None:
+        nonlocal saved
+        snapshots = senders.snapshot()
+        # senders that finished since the last checkpoint have nothing left to restore
+        await database.save_snapshots({**dict.fromkeys(saved - snapshots.keys()), **snapshots})
+        saved = set(snapshots)
+
+    async def checkpoint_periodically() -> None:
+        while True:
+            await asyncio.sleep(interval)
+            await checkpoint()
 
-    asyncio.create_task(senders[channel_id].start(send, cps, add_coin))  # noqa: RUF006
-    return False
+    task = asyncio.create_task(checkpoint_periodically())
+    try:
+        yield senders
+    finally:
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+        await checkpoint()
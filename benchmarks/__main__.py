@@ -0,0 +1,13 @@
+"""Run every benchmark.
+
+Run with `python -m benchmarks`.
+"""
+
+import asyncio
+
+from . import database, priority, scheduler, sender
+
+for benchmark in (sender, database, scheduler, priority):
+    print(f"## {benchmark.__name__}")
+    asyncio.run(benchmark.main())
+    print()
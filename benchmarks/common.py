@@ -0,0 +1,119 @@
+"""Fakes and measuring helpers shared by the benchmarks."""
+
+from __future__ import annotations
+
+import contextlib
+import dataclasses
+import time
+import tracemalloc
+from typing import TYPE_CHECKING
+
+from app.metrics import SenderMetrics
+from app.sender import Sender
+
+if TYPE_CHECKING:
+    from collections.abc import Awaitable, Callable, Iterator
+
+    from app.sender import Editable
+
+
+class FakeMessage:
+    """A message that ignores edits."""
+
+    id = 0
+
+    async def edit(self, *, content: str) -> object:
+        """Pretend to edit the message."""
+        return content
+
+
+async def fake_send(_: str) -> FakeMessage:
+    """Pretend to send a message."""
+    return FakeMessage()
+
+
+async def no_coin(_: int, __: int) -> None:
+    """Don't give out coins."""
+
+
+class WakeupMetrics(SenderMetrics):
+    """Counts how many times senders woke up, which they report through `lag`."""
+
+    def __init__(self) -> None:
+        self.wakeups = 0
+
+    def lag(self, _: int, __: float) -> None:
+        """Count a wakeup."""
+        self.wakeups += 1
+
+
+@dataclasses.dataclass
+class CountingSender(Sender):
+    """A sender that records how long each of its steps takes."""
+
+    step_times: list[float] = dataclasses.field(init=False, default_factory=list)
+
+    async def step(
+        self,
+        send: Callable[[str], Awaitable[Editable]],
+        cps: Callable[[int], Awaitable[float]],
+        add_coin: Callable[[int, int], Awaitable[None]],
+    ) -> None:
+        """Time the step."""
+        start = time.perf_counter()
+        await super().step(send, cps, add_coin)
+        self.step_times.append(time.perf_counter() - start)
+
+
+@dataclasses.dataclass
+class Measurement:
+    """What happened while running a workload."""
+
+    operations: int = 0
+    elapsed: float = 0
+    cpu: float = 0
+    peak_memory: int = 0
+    latencies: list[float] = dataclasses.field(default_factory=list)
+
+    @property
+    def rate(self) -> float:
+        """Get operations per second."""
+        return self.operations / self.elapsed if self.elapsed else 0
+
+    def percentile(self, fraction: float) -> float:
+        """Get a latency percentile, as a fraction between 0 and 1."""
+        if not self.latencies:
+            return float("nan")
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+@contextlib.contextmanager
+def measure() -> Iterator[Measurement]:
+    """Measure wall time, CPU time and peak Python memory of a workload.
+
+    Memory is traced with tracemalloc, which slows everything down, so times are only
+    comparable with other benchmarks in this suite.
+    """
+    measurement = Measurement()
+    tracemalloc.start()
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield measurement
+    finally:
+        measurement.elapsed = time.perf_counter() - start
+        measurement.cpu = time.process_time() - cpu_start
+        measurement.peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+
+HEADER = f"{'workload':<40} {'ops/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'peak KiB':>9}"
+
+
+def row(name: str, measurement: Measurement) -> str:
+    """Format a measurement as a line of a table."""
+    return (
+        f"{name:<40} {measurement.rate:>10.0f} {measurement.percentile(0.5) * 1e3:>8.3f} "
+        f"{measurement.percentile(0.99) * 1e3:>8.3f} {measurement.peak_memory / 1024:>9.0f}"
+    )
@@ -0,0 +1,123 @@
+"""Measure profile and channel operations against each database backend.
+
+Run with `python -m benchmarks.database`.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import random
+import tempfile
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from app.async_database import open_database
+from app.cache import ProfileCache
+from app.database import AbstractDatabase, Database, UserProfile
+from app.loader import ProfileLoader
+
+from .common import HEADER, Measurement, measure, row
+
+if TYPE_CHECKING:
+    from collections.abc import AsyncIterator, Awaitable, Callable
+
+GUILDS = 2
+# enough rows that a query scanning the table is clearly slower than a primary key lookup
+USERS = 100_000
+CHANNELS = 20
+OPERATIONS = 5000
+CONCURRENCY = 50
+
+
+@contextlib.asynccontextmanager
+async def memory_backend() -> AsyncIterator[AbstractDatabase]:
+    """Use the in-memory database."""
+    yield Database()
+
+
+@contextlib.asynccontextmanager
+async def sqlite_backend() -> AsyncIterator[AbstractDatabase]:
+    """Use the SQLite database in a temporary directory."""
+    with tempfile.TemporaryDirectory() as directory:
+        async with open_database(str(Path(directory) / "bench.db")) as database:
+            yield database
+
+
+@contextlib.asynccontextmanager
+async def cached_sqlite_backend() -> AsyncIterator[AbstractDatabase]:
+    """Use the SQLite database behind the profile cache."""
+    async with sqlite_backend() as database:
+        yield ProfileCache(database)
+
+
+@contextlib.asynccontextmanager
+async def batched_sqlite_backend() -> AsyncIterator[AbstractDatabase]:
+    """Use the SQLite database behind the profile loader."""
+    async with sqlite_backend() as database:
+        yield ProfileLoader(database)
+
+
+BACKENDS = {
+    "Database": memory_backend,
+    "AsyncDatabase": sqlite_backend,
+    "ProfileCache": cached_sqlite_backend,
+    "ProfileLoader": batched_sqlite_backend,
+}
+
+
+def random_key() -> tuple[int, int]:
+    """Pick a random (guild_id, user_id)."""
+    return random.randrange(GUILDS), random.randrange(USERS)  # noqa: S311
+
+
+async def fill(database: AbstractDatabase) -> None:
+    """Add the profiles and channels that the workloads use."""
+    await database.add_coins({(guild_id, user_id): 1 for guild_id in range(GUILDS) for user_id in range(USERS)})
+    for guild_id in range(GUILDS):
+        for channel_id in range(CHANNELS):
+            await database.enable_channel(guild_id, channel_id)
+
+
+async def timed(measurement: Measurement, operation: Awaitable[object]) -> None:
+    """Await an operation, recording how long it took."""
+    start = time.perf_counter()
+    await operation
+    measurement.latencies.append(time.perf_counter() - start)
+
+
+async def run(operation: Callable[[], Awaitable[object]], concurrency: int = 1) -> Measurement:
+    """Run `OPERATIONS` operations, `concurrency` at a time."""
+    with measure() as measurement:
+        for _ in range(OPERATIONS // concurrency):
+            await asyncio.gather(*(timed(measurement, operation()) for _ in range(concurrency)))
+
+    measurement.operations = OPERATIONS // concurrency * concurrency
+    return measurement
+
+
+async def bench(name: str, database: AbstractDatabase) -> None:
+    """Run every workload against a database."""
+    await fill(database)
+    workloads: dict[str, tuple[Callable[[], Awaitable[object]], int]] = {
+        "get_profile": (lambda: database.get_profile(*random_key()), 1),
+        f"get_profile x{CONCURRENCY} concurrent": (lambda: database.get_profile(*random_key()), CONCURRENCY),
+        "update_profile": (lambda: database.update_profile(*random_key(), UserProfile(coins=5)), 1),
+        "get_channels": (lambda: database.get_channels(random.randrange(GUILDS)), 1),  # noqa: S311
+        "add_coins (100 users)": (lambda: database.add_coins({random_key(): 1 for _ in range(100)}), 1),
+    }
+    for workload, (operation, concurrency) in workloads.items():
+        print(row(f"{name} {workload}", await run(operation, concurrency)))
+
+
+async def main() -> None:
+    """Run the benchmark."""
+    print(HEADER)
+    for name, backend in BACKENDS.items():
+        async with backend() as database:
+            await bench(name, database)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,55 @@
+"""Show how a saturated sender splits its capacity between priorities.
+
+Run with `python -m benchmarks.priority`.
+"""
+
+import asyncio
+import math
+
+from app.database import MessagePriority
+from app.sender import Sender
+
+from .common import fake_send, no_coin
+
+# whole steps, so every character counted was emitted within the time measured
+STEPS = 10
+CAPACITY = 200.0
+CPS = 100.0
+# top priority asks for less than its share, so its delay should stay bounded
+USERS = {MessagePriority.TOP: 1, MessagePriority.MIDDLE: 3, MessagePriority.BOTTOM: 5}
+
+
+async def constant_cps(_: int) -> float:
+    """Give every user the same cps."""
+    return CPS
+
+
+async def main() -> None:
+    """Run the benchmark."""
+    loop = asyncio.get_running_loop()
+    sender = Sender(batched=True, capacity=CAPACITY, max_backlog=math.inf, max_drain_time=math.inf)
+    # enough for every user to stay saturated however far apart the steps end up
+    length = int(CPS * STEPS * sender.ratelimit.period)
+    start = loop.time()
+    who = 0
+    for priority, users in USERS.items():
+        for _ in range(users):
+            sender.add_item(who, CPS, "a" * length, priority)
+            who += 1
+
+    for _ in range(STEPS):
+        await asyncio.sleep(sender.next_wakeup() - loop.time())
+        await sender.step(fake_send, constant_cps, no_coin)
+    elapsed = loop.time() - start
+
+    print(f"capacity {CAPACITY:.0f} chars/s, {STEPS} steps over {elapsed:.2f}s")
+    print(f"{'priority':>8} {'share':>6} {'demand':>7} {'chars/s':>8} {'mean delay':>11} {'max delay':>10}")
+    for priority, stats in sender.stats.items():
+        print(
+            f"{priority:>8} {sender.shares[priority]:>6} {CPS * USERS[priority]:>7.0f} "
+            f"{stats.emitted / elapsed:>8.1f} {stats.mean_delay:>10.2f}s {stats.max_delay:>9.2f}s"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,108 @@
+"""Compare one sender task per channel against the shared scheduler.
+
+Run with `python -m benchmarks.scheduler`.
+"""
+
+import asyncio
+import dataclasses
+import time
+
+from app.sender import Scheduler
+
+from .common import CountingSender, WakeupMetrics, fake_send, no_coin
+
+CHANNELS = [10, 1000, 10000]
+DURATION = 3
+CPS = 20.0
+
+
+async def constant_cps(_: int) -> float:
+    """Give every user the same cps."""
+    return CPS
+
+
+@dataclasses.dataclass
+class Run:
+    """What happened while running every channel for `DURATION` seconds."""
+
+    elapsed: float
+    cpu: float
+    # time spent in steps, which is CPU time since the fake requests never wait
+    step_cpu: float
+    steps: int
+    wakeups: int
+
+
+def fill(channels: int, metrics: WakeupMetrics) -> list[CountingSender]:
+    """Create senders with enough text queued to outlast the benchmark."""
+    senders = [CountingSender(batched=True, metrics=metrics) for _ in range(channels)]
+    for sender in senders:
+        sender.add_item(0, CPS, "a" * int(CPS * DURATION * 2))
+    return senders
+
+
+def finish(senders: list[CountingSender], start: float, cpu_start: float, wakeups: int) -> Run:
+    """Collect what happened since `start`."""
+    # a busy event loop wakes up from the sleep late, so the wall time is measured too
+    return Run(
+        elapsed=time.perf_counter() - start,
+        cpu=time.process_time() - cpu_start,
+        step_cpu=sum(sum(sender.step_times) for sender in senders),
+        steps=sum(len(sender.step_times) for sender in senders),
+        wakeups=wakeups,
+    )
+
+
+async def per_channel(channels: int) -> Run:
+    """Run one task per channel, each of which wakes up on its own."""
+    metrics = WakeupMetrics()
+    senders = fill(channels, metrics)
+
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    tasks = [asyncio.create_task(sender.start(fake_send, constant_cps, no_coin)) for sender in senders]
+    await asyncio.sleep(DURATION)
+    result = finish(senders, start, cpu_start, metrics.wakeups)
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return result
+
+
+async def shared(channels: int) -> Run:
+    """Run every channel through one scheduler, which wakes up once for all the senders due together."""
+    scheduler = Scheduler()
+    senders = fill(channels, WakeupMetrics())
+
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    for channel_id, sender in enumerate(senders):
+        scheduler.schedule(channel_id, sender, fake_send, constant_cps, no_coin)
+    await asyncio.sleep(DURATION)
+    result = finish(senders, start, cpu_start, scheduler.wakeups)
+
+    await scheduler.stop()
+    return result
+
+
+async def main() -> None:
+    """Run the benchmark."""
+    # overhead is CPU time spent outside of steps, on waking senders up and running the event loop
+    print(
+        f"{'channels':>8} {'mode':>11} {'cpu %':>6} {'overhead %':>11} {'overhead us/step':>17} "
+        f"{'steps/s':>8} {'wakeups/s':>10}"
+    )
+    for channels in CHANNELS:
+        for mode, benchmark in (("per-channel", per_channel), ("shared", shared)):
+            run = await benchmark(channels)
+            overhead = run.cpu - run.step_cpu
+            print(
+                f"{channels:>8} {mode:>11} {run.cpu / run.elapsed * 100:>6.1f} {overhead / run.elapsed * 100:>11.1f} "
+                f"{overhead / max(run.steps, 1) * 1e6:>17.1f} {run.steps / run.elapsed:>8.1f} "
+                f"{run.wakeups / run.elapsed:>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,108 @@
+"""Measure the sender's hot paths.
+
+Run with `python -m benchmarks.sender`.
+"""
+
+import asyncio
+import math
+import time
+
+from app.sender import RateLimit, Sender, TextBuffer
+
+from .common import CountingSender, WakeupMetrics, fake_send, measure, no_coin
+
+BUFFER_LENGTHS = [1000, 10000, 100000]
+# (users, characters per user) for draining as fast as possible
+DRAIN_WORKLOADS = [(1, 1000), (1, 10000), (1, 100000), (10, 10000)]
+# (users, cps) for sending in real time
+REALTIME_WORKLOADS = [(10, 20.0), (100, 20.0), (20, 500.0)]
+REALTIME_DURATION = 3
+
+
+async def unlimited_cps(_: int) -> float:
+    """Let every user send as fast as the sender can go."""
+    return 1e12
+
+
+def drain_string(length: int) -> float:
+    """Get the time spent per character consuming a string by slicing it."""
+    text = "a" * length
+    start = time.perf_counter()
+    while text:
+        _ = text[0]
+        text = text[1:]
+    return (time.perf_counter() - start) / length
+
+
+def drain_buffer(length: int) -> float:
+    """Get the time spent per character consuming a `TextBuffer`."""
+    buffer = TextBuffer()
+    buffer.append("a" * length)
+    start = time.perf_counter()
+    while buffer:
+        buffer.pop()
+    return (time.perf_counter() - start) / length
+
+
+async def drain_sender(users: int, length: int) -> None:
+    """Drain `users` buffers of `length` characters one character at a time."""
+    # more is queued than a channel admits, so its bounds are lifted, and so is the ratelimit,
+    # so that the time spent is the sender's and not spent waiting to send
+    metrics = WakeupMetrics()
+    sender = Sender(max_backlog=math.inf, max_drain_time=math.inf, ratelimit=RateLimit(period=0), metrics=metrics)
+    for who in range(users):
+        sender.add_item(who, await unlimited_cps(who), "a" * length)
+
+    with measure() as measurement:
+        await sender.start(fake_send, unlimited_cps, no_coin)
+
+    chars = users * length
+    print(
+        f"{users:>6} {length:>11} {metrics.wakeups:>8} {measurement.cpu / chars * 1e9:>12.0f} "
+        f"{measurement.peak_memory / 1024:>9.0f}"
+    )
+
+
+async def realtime_sender(users: int, cps: float) -> None:
+    """Send for a while in batched mode with every user at `cps`."""
+
+    async def constant_cps(_: int) -> float:
+        return cps
+
+    sender = CountingSender(batched=True, max_backlog=math.inf, max_drain_time=math.inf)
+    for who in range(users):
+        sender.add_item(who, cps, "a" * int(cps * REALTIME_DURATION))
+
+    with measure() as measurement:
+        await sender.start(fake_send, constant_cps, no_coin)
+
+    measurement.operations = users * int(cps * REALTIME_DURATION)
+    measurement.latencies = sender.step_times
+    print(
+        f"{users:>6} {cps:>11.0f} {measurement.rate:>10.0f} {len(measurement.latencies) / measurement.elapsed:>10.1f} "
+        f"{measurement.percentile(0.5) * 1e3:>8.3f} {measurement.percentile(0.99) * 1e3:>8.3f} "
+        f"{measurement.peak_memory / 1024:>9.0f}"
+    )
+
+
+async def main() -> None:
+    """Run the benchmark."""
+    print(f"{'chars':>7} {'slicing ns/char':>16} {'TextBuffer ns/char':>19}")
+    for length in BUFFER_LENGTHS:
+        print(f"{length:>7} {drain_string(length) * 1e9:>16.0f} {drain_buffer(length) * 1e9:>19.0f}")
+
+    print()
+    print("draining one character at a time, without a ratelimit (waking up for every character)")
+    print(f"{'users':>6} {'chars/user':>11} {'wakeups':>8} {'cpu ns/char':>12} {'peak KiB':>9}")
+    for users, length in DRAIN_WORKLOADS:
+        await drain_sender(users, length)
+
+    print()
+    print("sending in real time, batched (latency is time spent per step)")
+    print(f"{'users':>6} {'cps':>11} {'chars/s':>10} {'steps/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'peak KiB':>9}")
+    for users, cps in REALTIME_WORKLOADS:
+        await realtime_sender(users, cps)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
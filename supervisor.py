@@ -0,0 +1,66 @@
+"""Run the bot as several processes, each connected to some of the shards.
+
+Discord sends every event for a guild to the same shard, so each process owns the state of its
+guilds and the processes can share one database. Processes that exit are started again.
+"""
+
+import asyncio
+import contextlib
+import logging
+import os
+import signal
+import sys
+
+WORKERS = int(os.environ.get("WORKERS", os.cpu_count() or 1))
+SHARD_COUNT = int(os.environ.get("SHARD_COUNT", WORKERS))
+# Discord lets a bot identify one shard every 5 seconds
+IDENTIFY_INTERVAL = 5
+RESTART_DELAY = 5
+
+logger = logging.getLogger(__name__)
+
+
+def shards_for(worker: int) -> list[int]:
+    """Get the shards that a worker connects to, as a contiguous range."""
+    return [shard_id for shard_id in range(SHARD_COUNT) if shard_id * WORKERS // SHARD_COUNT == worker]
+
+
+async def run_worker(worker: int, shard_ids: list[int]) -> None:
+    """Run a worker process, starting it again whenever it exits."""
+    env = {**os.environ, "SHARD_COUNT": str(SHARD_COUNT), "SHARD_IDS": ",".join(map(str, shard_ids))}
+    # workers start one after another, so they don't all identify at once
+    await asyncio.sleep(shard_ids[0] * IDENTIFY_INTERVAL)
+
+    while True:
+        # in a session of their own, so Ctrl-C reaches workers only once, through the supervisor
+        process = await asyncio.create_subprocess_exec(sys.executable, "app.py", env=env, start_new_session=True)
+        try:
+            code = await process.wait()
+        except asyncio.CancelledError:
+            # let the worker save its state before exiting
+            with contextlib.suppress(ProcessLookupError):
+                process.send_signal(signal.SIGINT)
+            await process.wait()
+            raise
+
+        logger.warning(
+            "Worker %d (shards %s) exited with %d, restarting in %ds", worker, shard_ids, code, RESTART_DELAY
+        )
+        await asyncio.sleep(RESTART_DELAY)
+
+
+async def main() -> None:
+    """Run every worker until interrupted."""
+    if not 0 < WORKERS <= SHARD_COUNT:
+        msg = f"need between 1 and {SHARD_COUNT} workers, not {WORKERS}"
+        raise ValueError(msg)
+
+    async with asyncio.TaskGroup() as group:
+        for worker in range(WORKERS):
+            group.create_task(run_worker(worker, shards_for(worker)))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    with contextlib.suppress(KeyboardInterrupt):
+        asyncio.run(main())